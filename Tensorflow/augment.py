@@ -0,0 +1,71 @@
+import numpy as np
+
+
+def clip_matrix(params: dict, h: int, w: int):
+    """ 3x3 matrix mapping an output (row, col, 1) to the input coordinates
+    ``ImageDataGenerator.apply_transform`` samples for ``params``, as drawn
+    by ``get_random_transform``, flips included """
+    theta = np.deg2rad(params.get('theta', 0))
+    tx, ty = params.get('tx', 0), params.get('ty', 0)
+    shear = np.deg2rad(params.get('shear', 0))
+    zx, zy = params.get('zx', 1), params.get('zy', 1)
+
+    m = np.array([[np.cos(theta), -np.sin(theta), 0], [np.sin(theta), np.cos(theta), 0], [0, 0, 1]])
+    m = m @ np.array([[1, 0, tx], [0, 1, ty], [0, 0, 1]])
+    m = m @ np.array([[1, -np.sin(shear), 0], [0, np.cos(shear), 0], [0, 0, 1]])
+    m = m @ np.array([[zx, 0, 0], [0, zy, 0], [0, 0, 1]])
+
+    o_x, o_y = h / 2 - 0.5, w / 2 - 0.5
+    m = np.array([[1, 0, o_x], [0, 1, o_y], [0, 0, 1]]) @ m @ np.array([[1, 0, -o_x], [0, 1, -o_y], [0, 0, 1]])
+
+    # keras builds the matrix in (x, y) and swaps it to the (row, col) of the arrays
+    m = m[[1, 0, 2]][:, [1, 0, 2]]
+
+    # the flips come after the warp, so they flip the output coordinates
+    if params.get('flip_horizontal', False):
+        m = m @ np.array([[1, 0, 0], [0, -1, w - 1], [0, 0, 1]])
+    if params.get('flip_vertical', False):
+        m = m @ np.array([[-1, 0, h - 1], [0, 1, 0], [0, 0, 1]])
+    return m
+
+
+def warp_clips(x, matrices):
+    """ Resample every frame of each clip of a (batch, frames, H, W, C) array
+    at the coordinates given by the 3x3 matrix of its clip. Bilinear, with
+    the edge pixels repeated outside the frame, like scipy's order 1
+    'nearest' mode """
+    b, f, h, w, c = x.shape
+    rows, cols = np.mgrid[0:h, 0:w]
+    grid = np.stack([rows.ravel(), cols.ravel(), np.ones(h * w)])
+    coords = np.asarray(matrices)[:, :2] @ grid  # (batch, 2, H*W)
+
+    r, q = coords[:, 0], coords[:, 1]
+    r0, q0 = np.floor(r), np.floor(q)
+    wr = (r - r0)[..., None].astype(x.dtype)
+    wq = (q - q0)[..., None].astype(x.dtype)
+
+    # pixels as rows of frames x channels, so each lookup copies a contiguous row
+    flat = x.transpose(0, 2, 3, 1, 4).reshape(b, h * w, f * c)
+    clips = np.arange(b)[:, None]
+    def corner(ri, qi):
+        return flat[clips, np.clip(ri, 0, h - 1).astype(np.intp) * w + np.clip(qi, 0, w - 1).astype(np.intp)]
+
+    out = (corner(r0, q0) * (1 - wr) + corner(r0 + 1, q0) * wr) * (1 - wq)
+    out += (corner(r0, q0 + 1) * (1 - wr) + corner(r0 + 1, q0 + 1) * wr) * wq
+    return out.reshape(b, h, w, f, c).transpose(0, 3, 1, 2, 4)
+
+
+def augment_clips(transformation, x, params: list):
+    """ ``transformation.apply_transform`` of every frame, with one set of
+    parameters per clip, as a single vectorized warp of the whole batch.
+    Settings the warp does not cover fall back to the per-frame calls """
+    supported = (transformation.fill_mode == 'nearest' and transformation.interpolation_order == 1
+                 and transformation.data_format == 'channels_last'
+                 and all(p.get('channel_shift_intensity') is None and p.get('brightness') is None for p in params))
+    if not supported:
+        return np.array([[transformation.apply_transform(frame, p) for frame in clip] for clip, p in zip(x, params)])
+
+    h, w = x.shape[2:4]
+    out = warp_clips(x.astype(np.float32, copy=False), [clip_matrix(p, h, w) for p in params])
+    # integer frames, e.g. from the zip generator, stay integer like scipy's output
+    return out if out.dtype == x.dtype else np.rint(out).astype(x.dtype)
@@ -0,0 +1,208 @@
+#%% Import Packages
+import os
+import sys
+import json
+import time
+import shutil
+import zipfile
+import platform
+import argparse
+import resource
+import itertools
+import subprocess
+import numpy as np
+import multiprocessing
+
+from PIL import Image
+from queue import Empty
+
+#%% Parser
+str2bool = lambda x: (str(x).lower() == 'true')
+parser = argparse.ArgumentParser(description='Throughput of the training data loaders over a synthetic Jester-shaped dataset')
+parser.add_argument('--data', '-d', default='./synthetic', help="folder of the synthetic dataset, generated if missing.")
+parser.add_argument('--clips', '-n', default=200, type=int, help="number of synthetic clips.")
+parser.add_argument('--clip_frames', '-cf', nargs=2, default=[30, 40], type=int, help="min and max frames of a synthetic clip.")
+parser.add_argument('--regenerate', '-g', default=False, type=str2bool, help="generate the dataset again even if it exists.")
+parser.add_argument('--loaders', '-l', nargs='+', default=['folder', 'zip', 'memmap'], choices=('folder', 'zip', 'memmap'), help="loaders to measure.")
+parser.add_argument('--batch_sizes', '-b', nargs='+', default=[4, 16], type=int, help="batch sizes to measure.")
+parser.add_argument('--nb_frames', '-f', nargs='+', default=[12], type=int, help="frames per clip to measure.")
+parser.add_argument('--workers', '-w', nargs='+', default=[0, os.cpu_count()], type=int, help="worker processes to measure (0- in the training process).")
+parser.add_argument('--batches', '-nb', default=20, type=int, help="timed batches per measurement, after 2 warmup batches.")
+parser.add_argument('--augment', '-a', default=True, type=str2bool, help="apply the training augmentation of train.py.")
+parser.add_argument('--output', '-o', default='loader-benchmark.jsonl', help="JSON lines file the results are appended to.")
+args = parser.parse_args()
+
+#%% Synthetic dataset
+CLASSES = ['Doing other things', 'No gesture', 'Stop Sign', 'Swiping Left', 'Swiping Right',
+           'Swiping Up', 'Turning Hand Clockwise', 'Turning Hand Counterclockwise']
+
+# Jester frames are 100 pixels high and about 176 wide
+FRAME_SIZE = (176, 100)
+
+def write_clip(path, count, seed):
+    """ JPEG frames of a blob moving over a noisy gradient, so the frames
+    decode about as fast as real ones """
+    rng = np.random.RandomState(seed)
+    w, h = FRAME_SIZE
+    rows, cols = np.mgrid[0:h, 0:w]
+    background = (rng.rand(3) * 255 * (0.5 + 0.5 * cols[..., None] / w)).astype(np.float32)
+    start, speed = rng.rand(2) * (w, h), rng.randn(2) * 3
+
+    os.makedirs(path, exist_ok=True)
+    for i in range(count):
+        x, y = start + i * speed
+        blob = ((cols - x % w)**2 + (rows - y % h)**2 < 15**2)[..., None]
+        frame = np.where(blob, (230, 180, 150), background) + rng.randn(h, w, 3) * 8
+        Image.fromarray(np.clip(frame, 0, 255).astype(np.uint8)).save(os.path.join(path, '%05d.jpg' % (i + 1)), quality=90)
+
+def generate(root):
+    """ Frame folders, their zip archive, the ;-separated CSVs read by
+    train.py and a config.json pointing at them """
+    rng = np.random.RandomState(0)
+    videos = np.arange(1, args.clips + 1)
+    labels = rng.randint(len(CLASSES), size=args.clips)
+    counts = rng.randint(args.clip_frames[0], args.clip_frames[1] + 1, size=args.clips)
+
+    folders = os.path.join(root, 'jester')
+    # the frame store of a previous dataset would be read as is
+    for old in (folders, os.path.join(root, 'frames')):
+        shutil.rmtree(old, ignore_errors=True)
+    with multiprocessing.Pool() as pool:
+        pool.starmap(write_clip, [(os.path.join(folders, str(v)), int(c), int(v)) for v, c in zip(videos, counts)])
+
+    # the root folder comes first, the zip generator takes it from the first member
+    with zipfile.ZipFile(os.path.join(root, 'jester.zip'), 'w', zipfile.ZIP_STORED) as zipf:
+        zipf.writestr('jester/', '')
+        for video, count in zip(videos, counts):
+            for i in range(count):
+                name = 'jester/{}/{:05d}.jpg'.format(video, i + 1)
+                zipf.write(os.path.join(root, name), name)
+
+    split = int(.8 * args.clips)
+    for name, part in (('train.csv', slice(None, split)), ('test.csv', slice(split, None))):
+        with open(os.path.join(root, name), 'w') as f:
+            f.writelines('{};{}\n'.format(v, CLASSES[l]) for v, l in zip(videos[part], labels[part]))
+
+    config = {'data_path': folders, 'train_dataset': os.path.join(root, 'train.csv'), 'test_dataset': os.path.join(root, 'test.csv'),
+              'frame_store': os.path.join(root, 'frames')}
+    with open(os.path.join(root, 'config.json'), 'w') as jfile:
+        json.dump(config, jfile, indent=2)
+
+#%% Benchmark
+def measure(kind, root, batch_size, nb_frames, workers):
+    """ Samples per second, batch latencies and peak memory of one loader
+    setting. Runs in a fresh process, so the peak memory is its own """
+    import pandas as pd
+    from generator import frame_generator
+    from loader import ParallelLoader
+    from tensorflow.keras.preprocessing.image import ImageDataGenerator
+
+    with open(os.path.join(root, 'config.json')) as jfile:
+        config = json.load(jfile)
+    config['frame_store'] = config['frame_store'] if kind == 'memmap' else ''
+    config['data_path'] = config['data_path'] + '.zip' if kind == 'zip' else config['data_path']
+
+    # the same augmentation as train.py
+    datagen = ImageDataGenerator(rescale=1./255., zoom_range=0.2, horizontal_flip=True, rotation_range=5) if args.augment else None
+    train = pd.read_csv(config['train_dataset'], sep=';', header=None)
+    start = time.perf_counter()
+    generator = frame_generator(config, files=train[0], labels=train[1], target_shape=(100,100), transformation=datagen,
+                                nb_frames=nb_frames, batch_size=batch_size, seed=0)
+    loader = ParallelLoader(generator, workers) if workers else None
+    setup = time.perf_counter() - start
+
+    batches = iter(loader) if loader is not None else (generator[i] for i in range(len(generator)))
+    times, samples = [], 0
+    last = time.perf_counter()
+    try:
+        for i, (images, _) in enumerate(itertools.islice(batches, args.batches + 2)):
+            now = time.perf_counter()
+            # the first batches pay for starting the workers and filling the prefetch queue
+            if i >= 2:
+                times.append(now - last)
+                samples += len(images)
+            last = now
+        # the workers are children of the forkserver, not of this process, so
+        # their peak memory is read before they stop
+        workers_rss = max(peak_rss(pid) for pid in loader.pids) if loader is not None else None
+    finally:
+        if loader is not None:
+            loader.close()
+
+    times = np.array(times) * 1000
+    return {'samples_per_s': samples / (times.sum() / 1000) if len(times) else 0., 'batches': len(times),
+            'ms_batch_p50': float(np.percentile(times, 50)) if len(times) else None,
+            'ms_batch_p95': float(np.percentile(times, 95)) if len(times) else None,
+            'setup_s': setup,
+            # ru_maxrss is in KB on Linux; the workers report the largest of them
+            'rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+            'workers_rss_mb': workers_rss}
+
+def peak_rss(pid):
+    """ Peak resident memory of a running process in MB, from /proc """
+    with open('/proc/{}/status'.format(pid)) as f:
+        for line in f:
+            if line.startswith('VmHWM:'):
+                return int(line.split()[1]) / 1024
+    return 0.
+
+def isolated(queue, *task):
+    queue.put(measure(*task))
+
+def machine():
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except OSError:
+        commit = ''
+    import tensorflow as tf
+    return {'date': time.strftime('%Y-%m-%d %H:%M:%S'), 'commit': commit, 'host': platform.node(),
+            'cpu': platform.processor() or platform.machine(), 'cores': os.cpu_count(),
+            'python': platform.python_version(), 'tensorflow': tf.__version__}
+
+def main():
+    root = os.path.abspath(args.data)
+    if args.regenerate or not os.path.isfile(os.path.join(root, 'config.json')):
+        start = time.perf_counter()
+        generate(root)
+        print('[INFO] {} synthetic clips written to {} in {:.1f}s'.format(args.clips, root, time.perf_counter() - start))
+    if 'memmap' in args.loaders and not os.path.isfile(os.path.join(root, 'frames', 'index.json')):
+        framestore = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'framestore.py')
+        subprocess.run([sys.executable, framestore, '-c', os.path.join(root, 'config.json')], check=True)
+
+    info = machine()
+    settings = {'clips': args.clips, 'clip_frames': args.clip_frames, 'augment': args.augment}
+    print('{:7s} {:>5s} {:>6s} {:>7s} {:>9s} {:>9s} {:>9s} {:>8s} {:>10s}'.format(
+          'loader', 'batch', 'frames', 'workers', 'samples/s', 'p50 ms', 'p95 ms', 'RSS MB', 'worker MB'))
+    with open(args.output, 'a') as f:
+        for kind, batch_size, nb_frames, workers in itertools.product(args.loaders, args.batch_sizes, args.nb_frames, args.workers):
+            # a spawned process per setting, not a daemon so it can start the loader workers
+            context = multiprocessing.get_context('spawn')
+            queue = context.Queue()
+            process = context.Process(target=isolated, args=(queue, kind, root, batch_size, nb_frames, workers))
+            process.start()
+            result = None
+            # a crashed process (out of memory, failed import) never puts its result
+            while result is None:
+                try:
+                    result = queue.get(timeout=1.)
+                except Empty:
+                    if not process.is_alive():
+                        try:
+                            result = queue.get(timeout=1.)
+                        except Empty:
+                            pass
+                        break
+            process.join()
+            if result is None:
+                print('[ERROR] {} loader, batch {}, {} frames, {} workers failed with exit code {}'.format(
+                      kind, batch_size, nb_frames, workers, process.exitcode), flush=True)
+                continue
+            print('{:7s} {:>5d} {:>6d} {:>7d} {:>9.1f} {:>9.1f} {:>9.1f} {:>8.0f} {:>10s}'.format(
+                  kind, batch_size, nb_frames, workers, result['samples_per_s'], result['ms_batch_p50'] or 0, result['ms_batch_p95'] or 0,
+                  result['rss_mb'], '-' if result['workers_rss_mb'] is None else '{:.0f}'.format(result['workers_rss_mb'])), flush=True)
+            f.write(json.dumps({**info, **settings, 'loader': kind, 'batch_size': batch_size, 'nb_frames': nb_frames, 'workers': workers, **result}) + '\n')
+    print('[INFO] results appended to {}'.format(args.output))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,117 @@
+import json
+import numpy as np
+
+from augment import clip_matrix, warp_clips
+
+# spatial views of the test-time augmentation, the first ``crops`` are used
+CROPS = ('full', 'center', 'top-left', 'top-right', 'bottom-left', 'bottom-right')
+
+
+class Evaluation:
+    """ Loss, top-k accuracies and confusion matrix of a classifier,
+    accumulated batch by batch so the data is seen once """
+
+    def __init__(self, classes: list, k: tuple = (1, 5)):
+        self.classes = [str(c) for c in classes]
+        self.k = tuple(i for i in k if i <= len(classes))
+        self.matrix = np.zeros((len(classes), len(classes)), dtype=np.int64)
+        self.loss_sum = 0.
+        self.hits = {i: 0 for i in self.k}
+
+    def update(self, labels, probs):
+        """ Add a batch of one-hot ``labels`` and predicted ``probs`` """
+        truth = np.argmax(labels, axis=1)
+        # same clipping as the keras categorical crossentropy
+        self.loss_sum -= float(np.sum(np.log(np.clip(probs[np.arange(len(truth)), truth], 1e-7, 1.))))
+        ranks = np.argsort(-probs, axis=1)
+        for i in self.k:
+            self.hits[i] += int(np.sum(ranks[:, :i] == truth[:, None]))
+        np.add.at(self.matrix, (truth, ranks[:, 0]), 1)
+
+    @property
+    def count(self):
+        return int(self.matrix.sum())
+
+    @property
+    def loss(self):
+        return self.loss_sum / max(self.count, 1)
+
+    def accuracy(self, k: int = 1):
+        return self.hits[k] / max(self.count, 1)
+
+    @property
+    def kappa(self):
+        """ Cohen's kappa of the top-1 predictions, from the confusion matrix """
+        n = max(self.count, 1)
+        observed = np.trace(self.matrix) / n
+        expected = float(np.sum(self.matrix.sum(axis=0) * self.matrix.sum(axis=1))) / n**2
+        return (observed - expected) / (1 - expected) if expected < 1 else 1.
+
+    def report(self) -> dict:
+        truth, predicted = self.matrix.sum(axis=1), self.matrix.sum(axis=0)
+        per_class = {}
+        for i, name in enumerate(self.classes):
+            hits = int(self.matrix[i, i])
+            precision = hits / predicted[i] if predicted[i] else 0.
+            recall = hits / truth[i] if truth[i] else 0.
+            per_class[name] = {'support': int(truth[i]), 'precision': precision, 'recall': recall,
+                               'f1': 2 * precision * recall / (precision + recall) if precision + recall else 0.}
+
+        report = {'clips': self.count, 'loss': self.loss}
+        report.update({'top@{}'.format(i): self.accuracy(i) for i in self.k})
+        report.update({'kappa': self.kappa, 'classes': per_class, 'confusion_matrix': self.matrix.tolist()})
+        return report
+
+    def save(self, path: str):
+        with open(path, 'w') as jfile:
+            json.dump(self.report(), jfile, indent=2)
+
+
+def crop_matrices(crops: int, h: int, w: int, scale: float = .875):
+    """ Warp matrix of each of the first ``crops`` views of CROPS, a crop of
+    ``scale`` times the frame resized back to the full frame """
+    shift_h, shift_w = (1 - scale) * h / 2, (1 - scale) * w / 2
+    # tx moves the crop along the columns and ty along the rows
+    params = {'full': {}, 'center': {'zx': scale, 'zy': scale},
+              'top-left': {'zx': scale, 'zy': scale, 'tx': -shift_w, 'ty': -shift_h},
+              'top-right': {'zx': scale, 'zy': scale, 'tx': shift_w, 'ty': -shift_h},
+              'bottom-left': {'zx': scale, 'zy': scale, 'tx': -shift_w, 'ty': shift_h},
+              'bottom-right': {'zx': scale, 'zy': scale, 'tx': shift_w, 'ty': shift_h}}
+    return [clip_matrix(params[name], h, w) for name in CROPS[:crops]]
+
+
+def evaluate(model, generator, crops: int = 1, clips: int = 1, loader=None, verbose: int = 1):
+    """ Run ``model`` once over every batch of ``generator``, scoring each
+    prediction against the labels of its own batch.
+
+    With test-time augmentation, each clip is seen through ``clips`` windows
+    spread from its start to its end and ``crops`` spatial crops; all the
+    views of a batch go through the model in one call and their
+    probabilities are averaged. ``loader``, a ParallelLoader of the
+    generator, builds the batches in its worker processes """
+    assert 1 <= crops <= len(CROPS), "crops should be between 1 and {}".format(len(CROPS))
+    assert clips >= 1, "clips should be at least 1"
+    offsets = [None] if clips == 1 else np.linspace(0, 1, clips).tolist()
+    tasks = (generator.batch_task(index) + (offset,) for index in range(len(generator)) for offset in offsets)
+    batches = loader.imap(tasks) if loader is not None else (generator.load_batch(*task) for task in tasks)
+
+    h, w = generator.target_shape
+    matrices = crop_matrices(crops, h, w) if crops > 1 else None
+    result = Evaluation(generator.classes)
+    for index in range(len(generator)):
+        views = [next(batches) for _ in offsets]
+        images, labels = np.concatenate([x for x, _ in views]), views[0][1]
+        if not len(labels):
+            continue
+
+        if matrices is not None:
+            images = images.astype(np.float32, copy=False)
+            images = np.concatenate([warp_clips(images, [m] * len(images)) for m in matrices])
+
+        probs = np.asarray(model.predict_on_batch(images), dtype=np.float32)
+        result.update(labels, probs.reshape(-1, len(labels), probs.shape[-1]).mean(axis=0))
+        if verbose > 0:
+            print('\r[INFO] {}/{} batches, loss {:.4f}, top@1 {:.4f}'.format(index + 1, len(generator), result.loss, result.accuracy(1)), end='')
+    if verbose > 0:
+        print()
+    return result
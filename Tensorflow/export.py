@@ -0,0 +1,120 @@
+#%% Import Packages
+import os
+import sys
+import json
+import time
+import argparse
+import pandas as pd
+import tensorflow as tf
+
+from generator import *
+
+# the TFLite conversion is shared with the live loop in the repository root
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from backends import tflite_converter
+
+#%% Parser
+parser = argparse.ArgumentParser(description='Export a trained checkpoint to quantized TFLite models')
+parser.add_argument('--config', '-c', help='json config file path', default='./config.json')
+parser.add_argument('--checkpoint', '-cp', default=None, help="checkpoint to export, defaults to the one train.py writes.")
+parser.add_argument('--window', '-w', default=None, type=int, help="number of frames of the exported input, defaults to nb_frames.")
+parser.add_argument('--calibration', '-k', default=100, type=int, help="number of training clips used to calibrate the int8 model.")
+parser.add_argument('--samples', '-n', default=200, type=int, help="number of validation clips used to compare the models.")
+args = parser.parse_args()
+
+#%% Load Main Configs
+with open(args.config) as jfile:
+    config = json.load(jfile)
+
+#%% Export
+def clips(csv, window, n, shuffle):
+    """ Yield up to n (1, window, 100, 100, 3) clips, scaled like webcam.py does """
+    data = pd.read_csv(csv, sep=';', header=None)
+    generator = frame_generator(config,
+                    files=data[0],
+                    labels=data[1],
+                    target_shape=(100,100),
+                    nb_frames=window,
+                    batch_size=1,
+                    shuffle=shuffle)
+
+    for i in range(min(n, len(generator))):
+        x, y = generator[i]
+        if len(x):
+            yield (x/255.).astype(np.float32), y
+
+def quantize(model, window, mode):
+    converter = tflite_converter(model, (window, 100, 100, 3))
+    if mode == 'float32':
+        # no quantization, the reference for the conversion itself
+        return converter.convert()
+    converter.optimizations = [tf.lite.Optimize.DEFAULT]
+
+    if mode == 'int8':
+        # weights and activations in int8, input and output stay float32 so
+        # the live loop can feed the model the same way as the float one
+        converter.representative_dataset = lambda: ([x] for x, _ in clips(config['train_dataset'], window, args.calibration, True))
+        converter.target_spec.supported_ops = [tf.lite.OpsSet.TFLITE_BUILTINS_INT8]
+
+    return converter.convert()
+
+def run_tflite(interpreter):
+    def run(x):
+        interpreter.set_tensor(interpreter.get_input_details()[0]['index'], x)
+        interpreter.invoke()
+        return interpreter.get_tensor(interpreter.get_output_details()[0]['index'])
+    return run
+
+def latency(fn, x, n=20):
+    """ Mean milliseconds per call of ``fn``, after a warmup call """
+    fn(x)
+    start = time.perf_counter()
+    for _ in range(n):
+        fn(x)
+    return (time.perf_counter() - start) / n * 1000
+
+def main():
+    checkpoint = args.checkpoint or config['checkpoint']+config['model_name']+'.h5'
+    window = args.window or config['nb_frames']
+    model = tf.keras.models.load_model(checkpoint)
+
+    runs = {}
+    report = {'keras': {'path': checkpoint, 'size': os.path.getsize(checkpoint)}}
+    for mode in ('float32', 'dynamic', 'int8'):
+        path = os.path.splitext(checkpoint)[0] + '-' + mode + '.tflite'
+        with open(path, 'wb') as f:
+            f.write(quantize(model, window, mode))
+        print('[INFO] {} model saved to {}'.format(mode, path))
+
+        interpreter = tf.lite.Interpreter(model_path=path)
+        interpreter.allocate_tensors()
+        runs[mode] = run_tflite(interpreter)
+        report[mode] = {'path': path, 'size': os.path.getsize(path)}
+
+    # compare the TFLite models against the Keras one on validation data
+    agree = {mode: 0 for mode in runs}
+    total = 0
+    for x, _ in clips(config['validation_dataset'], window, args.samples, False):
+        reference = np.argmax(model(x, training=False).numpy())
+        for mode, run in runs.items():
+            agree[mode] += int(np.argmax(run(x)) == reference)
+        total += 1
+
+    # every model timed over the same number of calls
+    x = np.random.rand(1, window, 100, 100, 3).astype(np.float32)
+    report['keras']['latency'] = latency(lambda x: model(x, training=False), x)
+    for mode, run in runs.items():
+        report[mode]['latency'] = latency(run, x)
+
+    print('{:<10}{:>12}{:>15}{:>18}'.format('Model', 'Size (MB)', 'Latency (ms)', 'Top@1 agreement'))
+    for mode, row in report.items():
+        if mode in agree:
+            row['agreement'] = agree[mode] / total if total else float('nan')
+        print('{:<10}{:>12.2f}{:>15.2f}{:>18}'.format(mode, row['size'] / 2**20, row['latency'],
+                                                     '{:.3f}'.format(row['agreement']) if 'agreement' in row else 'reference'))
+
+    with open(os.path.splitext(checkpoint)[0] + '-export.json', 'w') as jfile:
+        json.dump(report, jfile, indent=2)
+
+if __name__ == '__main__':
+    main()
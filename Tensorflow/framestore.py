@@ -0,0 +1,70 @@
+#%% Import Packages
+import os
+import json
+import time
+import argparse
+import numpy as np
+import pandas as pd
+
+from multiprocessing import Pool
+from generator import natural_key
+from tensorflow.keras.preprocessing.image import img_to_array, load_img
+
+#%% Parser
+parser = argparse.ArgumentParser(description='Decode the Jester clips once into memory-mapped uint8 shards')
+parser.add_argument('--config', '-c', help='json config file path', default='./config.json')
+parser.add_argument('--output', '-o', default=None, help="folder of the frame store, defaults to frame_store in the config.")
+parser.add_argument('--size', '-s', default=100, type=int, help="height and width of the stored frames.")
+parser.add_argument('--channels', '-ch', default=3, type=int, choices=(1, 3), help="3- RGB, 1- grayscale.")
+parser.add_argument('--workers', '-w', default=os.cpu_count(), type=int, help="number of processes decoding the clips.")
+args = parser.parse_args()
+
+#%% Load Main Configs
+with open(args.config) as jfile:
+    config = json.load(jfile)
+
+#%% Convert
+SHARDS = {'train': 'train_dataset', 'test': 'test_dataset', 'validation': 'validation_dataset'}
+
+def decode(video):
+    """ Every frame of a clip, in natural file name order, resized like VideoFrameGenerator does """
+    video_path = os.path.join(config['data_path'], str(video))
+    color_mode = 'grayscale' if args.channels == 1 else 'rgb'
+    return np.array([img_to_array(load_img(os.path.join(video_path, frame), color_mode=color_mode, target_size=(args.size, args.size)), dtype=np.uint8)
+                     for frame in sorted(os.listdir(video_path), key=natural_key)])
+
+def convert(shard, videos, path):
+    """ Write the clips of ``videos`` one after the other into ``path`` and
+    return their (shard, offset, count) """
+    counts = [len(os.listdir(os.path.join(config['data_path'], str(video)))) for video in videos]
+    offsets = np.concatenate([[0], np.cumsum(counts)]).tolist()
+    frames = np.lib.format.open_memmap(path, mode='w+', dtype=np.uint8, shape=(offsets[-1], args.size, args.size, args.channels))
+
+    with Pool(args.workers) as pool:
+        for i, clip in enumerate(pool.imap(decode, videos, chunksize=16)):
+            frames[offsets[i]:offsets[i+1]] = clip
+    frames.flush()
+    return {str(video): [shard, offsets[i], counts[i]] for i, video in enumerate(videos)}
+
+def main():
+    output = args.output or config.get('frame_store') or 'frames'
+    os.makedirs(output, exist_ok=True)
+
+    index = {'target_shape': [args.size, args.size], 'nb_channel': args.channels, 'shards': [], 'videos': {}}
+    for shard, key in SHARDS.items():
+        if not os.path.isfile(config.get(key, '')):
+            continue
+        start = time.perf_counter()
+        videos = pd.read_csv(config[key], sep=';', header=None)[0].unique().tolist()
+        path = os.path.join(output, shard + '.npy')
+        index['videos'].update(convert(shard, videos, path))
+        index['shards'].append(shard)
+        print('[INFO] {}: {} clips, {:.1f} MB in {:.1f}s'.format(shard, len(videos), os.path.getsize(path) / 2**20, time.perf_counter() - start))
+
+    # written last, a store without its index is never used half converted
+    with open(os.path.join(output, 'index.json'), 'w') as jfile:
+        json.dump(index, jfile)
+    print('[INFO] frame store saved to {}, set "frame_store" to it in the config to train from it'.format(output))
+
+if __name__ == '__main__':
+    main()
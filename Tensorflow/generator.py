@@ -1,12 +1,22 @@
 import io
 import os
+import re
+import json
 import zipfile
 import numpy as np
 
+from concurrent.futures import ThreadPoolExecutor
+
 from PIL import Image
+from augment import augment_clips
 from tensorflow.keras.utils import Sequence
 from tensorflow.keras.preprocessing.image import ImageDataGenerator, img_to_array, load_img
 
+def natural_key(name: str):
+    """ Sort key putting frame10.jpg after frame9.jpg """
+    return [int(part) if part.isdigit() else part for part in re.split(r'(\d+)', name)]
+
+
 class VideoFrameGenerator(Sequence):
     def __init__(
             self,
@@ -19,6 +29,8 @@ class VideoFrameGenerator(Sequence):
             shuffle: bool = True,
             transformation: ImageDataGenerator = None,
             nb_channel: int = 3,
+            seed: int = None,
+            keep_last: bool = False,
             *args,
             **kwargs):
 
@@ -34,12 +46,18 @@ class VideoFrameGenerator(Sequence):
         self.target_shape = target_shape
         self.nb_channel = 'grayscale' if nb_channel == 1 else 'rgb'
         self.transformation = transformation
+        self.seed = seed
+        self.keep_last = keep_last
+        self.epoch = 0
+        self.rng = np.random
+        self.offset = None
 
         self._random_trans = []
         self.files = files
         self.labels = labels
         self.path = path
         self.classes = np.unique(labels).tolist()
+        self.frame_files = self._frame_index() if path is not None else {}
 
         # build indexes
         self.files_count = len(self.files)
@@ -64,16 +82,36 @@ class VideoFrameGenerator(Sequence):
 
     def on_epoch_end(self):
         """ Called by Keras after each epoch """
+        # with a seed, every epoch draws from its own reproducible stream
+        rng = np.random if self.seed is None else np.random.RandomState((self.seed, self.epoch))
+        self.epoch += 1
 
         if self.transformation is not None:
             self._random_trans = []
             for _ in range(self.files_count):
                 self._random_trans.append(
-                    self.transformation.get_random_transform(self.target_shape)
+                    self.transformation.get_random_transform(self.target_shape,
+                        seed=None if self.seed is None else rng.randint(2**31))
                 )
 
         if self.shuffle:
-            np.random.shuffle(self.indexes)
+            rng.shuffle(self.indexes)
+
+    def __getstate__(self):
+        # pickled once for each worker process of a ParallelLoader, files and
+        # mappings are left out and opened again by ``reopen``
+        state = self.__dict__.copy()
+        state['rng'] = None
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.rng = np.random
+
+    def reopen(self):
+        """ Called in each worker process of a ParallelLoader, before it
+        loads its first batch """
+        pass
 
     def __iter__(self):
         return self
@@ -82,24 +120,43 @@ class VideoFrameGenerator(Sequence):
         return self.next()
 
     def __len__(self):
+        # with keep_last, a smaller last batch holds the clips left over
+        if self.keep_last:
+            return int(np.ceil(self.files_count / self.batch_size))
         return int(np.floor(self.files_count / self.batch_size))
 
     def __getitem__(self, index):
+        return self.load_batch(*self.batch_task(index))
+
+    def batch_task(self, index):
+        """ Everything batch ``index`` of the current epoch depends on: its
+        sample indexes, their random transformations and the seed of its
+        other random numbers, so a worker process can build it """
+        indexes = self.indexes[index*self.batch_size:(index+1)*self.batch_size]
+        transformations = [self._random_trans[i] for i in indexes] if self.transformation is not None else None
+        seed = None if self.seed is None else (self.seed, self.epoch, index)
+        return indexes, transformations, seed
+
+    def load_batch(self, indexes, transformations=None, seed=None, offset=None):
+        """ (images, labels) of the clips at ``indexes``. ``offset``, a
+        fraction of the clip, fixes where the window of frames starts """
         classes = self.classes
         shape = self.target_shape
         nbframe = self.nbframe
 
         labels = []
         images = []
+        params = []
 
-        indexes = self.indexes[index*self.batch_size:(index+1)*self.batch_size]
-
+        # without a seed, the frames are jittered from the global random state
+        self.rng = np.random if seed is None else np.random.RandomState(seed)
+        self.offset = offset
         transformation = None
 
-        for i in indexes:
+        for n, i in enumerate(indexes):
             # prepare a transformation if provided
-            if self.transformation is not None:
-                transformation = self._random_trans[i]
+            if transformations is not None:
+                transformation = transformations[n]
 
             video = self.files[i]
             classname = self.labels[i]
@@ -114,23 +171,66 @@ class VideoFrameGenerator(Sequence):
             if frames is None:
                 continue # avoid failure, nevermind that video...
 
-            # apply transformation
-            if transformation is not None:
-                frames = [self.transformation.apply_transform(
-                    frame, transformation) for frame in frames]
-
             # add the sequence in batch
             images.append(frames)
             labels.append(label)
-
-        return np.array(images), np.array(labels)
+            params.append(transformation)
+
+        # the transformation of each clip, applied to the whole batch at once
+        images = np.array(images)
+        if transformations is not None and len(images):
+            images = augment_clips(self.transformation, images, params)
+
+        return images, np.array(labels)
+
+    def _frame_index(self):
+        """ Map each video id to its naturally sorted frame files. The folders
+        are listed in parallel and the result saved as a manifest next to
+        them, with the mtime of every video folder; a later run lists again
+        only the folders added or changed since (frames added or removed) """
+        manifest = os.path.normpath(self.path) + '.manifest.json'
+        try:
+            with open(manifest) as jfile:
+                saved = json.load(jfile)
+            known, listed = saved['mtimes'], saved['videos']
+        except (OSError, ValueError, KeyError):
+            known, listed = {}, {}
+
+        with os.scandir(self.path) as entries:
+            videos = [entry.name for entry in entries if entry.is_dir()]
+        # listing is latency bound on network mounts, threads overlap the round trips
+        with ThreadPoolExecutor(max_workers=32) as pool:
+            mtimes = dict(zip(videos, pool.map(lambda video: os.stat(os.path.join(self.path, video)).st_mtime, videos)))
+            stale = [video for video in videos if known.get(video) != mtimes[video]]
+            listings = pool.map(lambda video: sorted(os.listdir(os.path.join(self.path, video)), key=natural_key), stale)
+            index = {video: listed[video] for video in videos if known.get(video) == mtimes[video]}
+            index.update(zip(stale, listings))
+
+        if stale or len(listed) != len(index):
+            try:
+                with open(manifest + '.tmp', 'w') as jfile:
+                    json.dump({'mtimes': mtimes, 'videos': index}, jfile)
+                os.replace(manifest + '.tmp', manifest)
+            except OSError:
+                pass  # read-only folder, the index is rebuilt on the next run
+        return index
+
+    def _jitter(self, total_frames, nbframe):
+        """ First frame of the window, at random unless ``offset`` is set """
+        if total_frames <= nbframe:
+            return 0
+        if self.offset is not None:
+            return int(round(self.offset * (total_frames - nbframe)))
+        return self.rng.randint(0, total_frames-nbframe+1)
 
     def _get_frames(self, video, nbframe, shape):
+        cap = self.frame_files.get(str(video))
+        if not cap:
+            return None
         video_path = os.path.join(self.path, str(video))
-        cap = os.listdir(video_path)
         total_frames = len(cap)
 
-        jitter = np.random.randint(0, total_frames-nbframe+1) if total_frames > nbframe else 0
+        jitter = self._jitter(total_frames, nbframe)
         frames = []
 
         for iframe in cap[jitter:nbframe+jitter]:
@@ -164,15 +264,59 @@ class VideoFrameGeneratorZip(VideoFrameGenerator):
         self.zipfile = zipf
         self.path = self.zipfile.namelist()[0]
         self.nb_channel = 'RGB' if self.nb_channel == 'rgb' else 'L'
+        self.members = self._member_index()
+
+    def __getstate__(self):
+        state = super().__getstate__()
+        state['zipfile'] = self.zipfile.filename
+        return state
+
+    def reopen(self):
+        # the worker gets the path of the archive, not the open file
+        self.zipfile = zipfile.ZipFile(self.zipfile)
+
+    def _member_index(self):
+        """ Map each video id to its sorted JPEG members with a single pass
+        over the archive. The index is saved next to the archive and reused
+        while the archive is unchanged """
+        index_path = None
+        if self.zipfile.filename and os.path.isfile(self.zipfile.filename):
+            stat = os.stat(self.zipfile.filename)
+            key = {'size': stat.st_size, 'mtime': stat.st_mtime, 'root': self.path}
+            index_path = self.zipfile.filename + '.index.json'
+            try:
+                with open(index_path) as jfile:
+                    saved = json.load(jfile)
+                if saved['key'] == key:
+                    return saved['videos']
+            except (OSError, ValueError, KeyError):
+                pass
+
+        videos = {}
+        for name in self.zipfile.namelist():
+            if name.startswith(self.path) and name.endswith(('.jpg', '.JPG',  '.jpeg', '.JPEG')):
+                video, _, frame = name[len(self.path):].partition('/')
+                if frame:
+                    videos.setdefault(video, []).append(name)
+        for members in videos.values():
+            members.sort(key=natural_key)
+
+        if index_path is not None:
+            try:
+                with open(index_path + '.tmp', 'w') as jfile:
+                    json.dump({'key': key, 'videos': videos}, jfile)
+                os.replace(index_path + '.tmp', index_path)
+            except OSError:
+                pass  # read-only folder, the index is rebuilt on the next run
+        return videos
 
     def _get_frames(self, video, nbframe, shape):
-        video = str(video)
-        video_path = os.path.join(self.path, video)
-        cap = [frame for frame in self.zipfile.namelist() if frame if frame.startswith(video_path + os.path.sep)\
-            and frame.endswith(('.jpg', '.JPG',  '.jpeg', '.JPEG'))]
+        cap = self.members.get(str(video))
+        if not cap:
+            return None
         total_frames = len(cap)
         
-        jitter = np.random.randint(0, total_frames-nbframe+1) if total_frames > nbframe else 0
+        jitter = self._jitter(total_frames, nbframe)
         frames = []
 
         for iframe in cap[jitter:nbframe+jitter]:
@@ -194,4 +338,58 @@ class VideoFrameGeneratorZip(VideoFrameGenerator):
             else:
                 break
 
-        return np.array(frames)
\ No newline at end of file
+        return np.array(frames)
+
+
+class VideoFrameGeneratorMemmap(VideoFrameGenerator):
+    """ Reads clips from a frame store written by framestore.py, slicing the
+    frames straight out of memory-mapped uint8 shards instead of opening and
+    decoding one JPEG per frame """
+    def __init__(self,
+                store: str = None,
+                **kwargs):
+        super().__init__(**kwargs)
+
+        with open(os.path.join(store, 'index.json')) as jfile:
+            info = json.load(jfile)
+        assert tuple(info['target_shape']) == tuple(self.target_shape), \
+            "The store holds {} frames, rebuild it for {}".format(tuple(info['target_shape']), tuple(self.target_shape))
+
+        self.store = store
+        self.videos = info['videos']
+        self.shard_names = info['shards']
+        self.reopen()
+
+    def __getstate__(self):
+        # a pickled memory map would copy the whole shard
+        state = super().__getstate__()
+        state['shards'] = None
+        return state
+
+    def reopen(self):
+        self.shards = {shard: np.load(os.path.join(self.store, shard + '.npy'), mmap_mode='r') for shard in self.shard_names}
+
+    def _get_frames(self, video, nbframe, shape):
+        if str(video) not in self.videos:
+            return None
+        shard, offset, total_frames = self.videos[str(video)]
+
+        jitter = self._jitter(total_frames, nbframe)
+        start = offset + jitter
+        frames = self.shards[shard][start:start + min(nbframe, total_frames)].astype(np.float32)
+
+        # repeat the last frame of short clips
+        if len(frames) < nbframe:
+            frames = np.concatenate([frames, np.repeat(frames[-1:], nbframe - len(frames), axis=0)])
+        return frames
+
+
+def frame_generator(config: dict, **kwargs):
+    """ Generator over the frame store of ``config`` if it has one, over the
+    archive or the JPEG folders of ``data_path`` otherwise """
+    kwargs.setdefault('seed', config.get('seed'))
+    if config.get('frame_store'):
+        return VideoFrameGeneratorMemmap(store=config['frame_store'], **kwargs)
+    if config['data_path'].endswith('.zip'):
+        return VideoFrameGeneratorZip(zipf=zipfile.ZipFile(config['data_path']), **kwargs)
+    return VideoFrameGenerator(path=config['data_path'], **kwargs)
@@ -0,0 +1,90 @@
+import os
+import multiprocessing
+import numpy as np
+import tensorflow as tf
+
+from collections import deque
+
+# the generator of a worker process, copied once when the pool starts
+_generator = None
+
+
+def _start_worker(generator):
+    global _generator
+    _generator = generator
+    _generator.reopen()
+
+
+def _load_batch(task):
+    return _generator.load_batch(*task)
+
+
+class ParallelLoader:
+    """ Builds the batches of a VideoFrameGenerator on a pool of worker
+    processes, in order and up to ``prefetch`` batches ahead of training.
+
+    The epoch state (shuffled indexes, random transformations) stays in the
+    calling process; each task carries what its batch needs, and the batch
+    draws its random numbers from (seed, epoch, batch), so the batches do
+    not depend on the number of workers. Without a seed one is drawn at
+    construction, otherwise the batches would depend on which worker builds
+    them. ``close`` the loader, or use it in a ``with`` block, to stop the
+    workers. """
+
+    def __init__(self, generator, workers: int = None, prefetch: int = None):
+        if generator.seed is None:
+            generator.seed = np.random.randint(2**31)
+
+        self.generator = generator
+        self.workers = workers or os.cpu_count()
+        self.prefetch = prefetch or 2 * self.workers
+
+        # not fork, TensorFlow already runs threads in this process that a
+        # forked worker could inherit locked; the workers get a pickled copy
+        # of the generator and map the stores again
+        methods = multiprocessing.get_all_start_methods()
+        context = multiprocessing.get_context('forkserver' if 'forkserver' in methods else 'spawn')
+        self.pool = context.Pool(self.workers, _start_worker, (generator,))
+
+    def __len__(self):
+        return len(self.generator)
+
+    def __iter__(self):
+        """ One epoch of (images, labels) batches, after which the generator
+        moves on to the next epoch """
+        yield from self.imap(self.generator.batch_task(index) for index in range(len(self.generator)))
+        self.generator.on_epoch_end()
+
+    def imap(self, tasks):
+        """ The batches of any ``load_batch`` argument tuples, in order """
+        pending = deque()
+        for task in tasks:
+            pending.append(self.pool.apply_async(_load_batch, (task,)))
+            if len(pending) > self.prefetch:
+                yield pending.popleft().get()
+        while pending:
+            yield pending.popleft().get()
+
+    def dataset(self):
+        """ The batches as a tf.data.Dataset that ``fit`` iterates once per epoch """
+        g = self.generator
+        channels = 1 if g.nb_channel in ('grayscale', 'L') else 3
+        signature = (tf.TensorSpec((None, g.nbframe) + tuple(g.target_shape) + (channels,), tf.float32),
+                     tf.TensorSpec((None, len(g.classes)), tf.float32))
+        data = tf.data.Dataset.from_generator(lambda: iter(self), output_signature=signature)
+        return data.apply(tf.data.experimental.assert_cardinality(len(self)))
+
+    @property
+    def pids(self):
+        """ Process ids of the workers """
+        return [process.pid for process in self.pool._pool]
+
+    def close(self):
+        self.pool.terminate()
+        self.pool.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -1,5 +1,18 @@
 import tensorflow as tf
 
+# per-frame backbones, wrapped in TimeDistributed by build_model
+CONVNETS = {}
+# whole clip models whose backbone mixes information across frames
+CLIP_MODELS = {}
+
+def register(registry):
+    """ Make a builder selectable by its name through config['convnet'] """
+    def add(fn):
+        registry[fn.__name__] = fn
+        return fn
+    return add
+
+@register(CONVNETS)
 def ConvBatch(shape=(100, 100, 3), momentum=.9):
     model = tf.keras.Sequential([
     tf.keras.layers.Conv2D(64, (3,3), input_shape=shape, padding='same', activation='relu'),
@@ -28,18 +41,132 @@ def ConvBatch(shape=(100, 100, 3), momentum=.9):
     tf.keras.layers.GlobalAveragePooling2D()
     ])
     return model
-    
-def build_model(shape=(1, 100, 100, 3), n_classes = 3, convnet=None):
-    assert convnet is not None, "Please, provide a build model function."
-    convnet_model = convnet(shape[1:])
-    model = tf.keras.Sequential([
-        tf.keras.layers.TimeDistributed(convnet_model, input_shape=shape),
+
+def separable(filters, strides=1, momentum=.9):
+    """ Depthwise 3x3 then pointwise 1x1 convolution, MobileNet style """
+    return [
+    tf.keras.layers.DepthwiseConv2D((3,3), strides=strides, padding='same', use_bias=False),
+    tf.keras.layers.BatchNormalization(momentum=momentum),
+    tf.keras.layers.ReLU(6.),
+    tf.keras.layers.Conv2D(filters, (1,1), use_bias=False),
+    tf.keras.layers.BatchNormalization(momentum=momentum),
+    tf.keras.layers.ReLU(6.)
+    ]
+
+def stem(shape, filters=32, momentum=.9):
+    return [
+    tf.keras.layers.Conv2D(filters, (3,3), strides=2, input_shape=shape, padding='same', use_bias=False),
+    tf.keras.layers.BatchNormalization(momentum=momentum),
+    tf.keras.layers.ReLU(6.)
+    ]
+
+@register(CONVNETS)
+def MobileNetLite(shape=(100, 100, 3), momentum=.9):
+    """ Strided stem and depthwise separable blocks, down to 7x7 x 256 """
+    model = tf.keras.Sequential(
+    stem(shape, 32, momentum) +
+    separable(64, 1, momentum) +
+    separable(128, 2, momentum) +
+    separable(128, 1, momentum) +
+    separable(256, 2, momentum) +
+    separable(256, 1, momentum) +
+    separable(256, 2, momentum) +
+    [tf.keras.layers.GlobalAveragePooling2D()]
+    )
+    return model
+
+def gru_head(n_classes):
+    return [
         tf.keras.layers.GRU(120, activation='relu'),
         tf.keras.layers.Dropout(.2),
         tf.keras.layers.Dense(60, activation='relu'),
         tf.keras.layers.Dropout(.2),
         tf.keras.layers.Dense(30, activation='relu'),
         tf.keras.layers.Dropout(.2),
-        tf.keras.layers.Dense(n_classes, activation='softmax')
-    ])
+        # kept in float32 under mixed precision, so the probabilities and the loss stay accurate
+        tf.keras.layers.Dense(n_classes, activation='softmax', dtype='float32')
+    ]
+
+def pool_head(n_classes):
+    """ Average of the frame features over time, cheaper than the GRU but
+    blind to the order of the frames """
+    return [
+        tf.keras.layers.GlobalAveragePooling1D(),
+        tf.keras.layers.Dropout(.2),
+        tf.keras.layers.Dense(60, activation='relu'),
+        tf.keras.layers.Dropout(.2),
+        tf.keras.layers.Dense(n_classes, activation='softmax', dtype='float32')
+    ]
+
+# temporal heads, selected by config['head']
+HEADS = {'gru': gru_head, 'pool': pool_head}
+
+def build_model(shape=(1, 100, 100, 3), n_classes = 3, convnet=None, head='gru'):
+    assert convnet is not None, "Please, provide a build model function."
+    convnet_model = convnet(shape[1:])
+    model = tf.keras.Sequential([
+        tf.keras.layers.TimeDistributed(convnet_model, input_shape=shape)
+    ] + HEADS[head](n_classes))
     return model
+
+def temporal_shift(x, fold=8):
+    """ Move 1/fold of the channels one frame forward in time and another
+    1/fold one frame backward, zero padded, on a (batch, T, H, W, C) tensor.
+    Built from stock layers so checkpoints load without custom objects """
+    t, h, w, c = x.shape[1:]
+    n = c // fold
+    # (T, H*W, C, 1) lets the 3D padding and cropping layers address time and channels
+    x = tf.keras.layers.Reshape((t, h * w, c, 1))(x)
+    forward = tf.keras.layers.ZeroPadding3D(((1, 0), (0, 0), (0, 0)))(x)
+    forward = tf.keras.layers.Cropping3D(((0, 1), (0, 0), (0, c - n)))(forward)
+    backward = tf.keras.layers.ZeroPadding3D(((0, 1), (0, 0), (0, 0)))(x)
+    backward = tf.keras.layers.Cropping3D(((1, 0), (0, 0), (n, c - 2 * n)))(backward)
+    rest = tf.keras.layers.Cropping3D(((0, 0), (0, 0), (2 * n, 0)))(x)
+    x = tf.keras.layers.Concatenate(axis=3)([forward, backward, rest])
+    return tf.keras.layers.Reshape((t, h, w, c))(x)
+
+@register(CLIP_MODELS)
+def TSM(shape=(12, 100, 100, 3), n_classes=3, head='gru', momentum=.9):
+    """ MobileNetLite blocks with a temporal shift before each of them, so
+    frames exchange information at no extra FLOPs """
+    inputs = tf.keras.Input(shape=shape)
+    x = tf.keras.layers.TimeDistributed(tf.keras.Sequential(stem(shape[1:], 32, momentum)))(inputs)
+    for filters, strides in ((64, 1), (128, 2), (128, 1), (256, 2), (256, 1), (256, 2)):
+        block = tf.keras.Sequential(separable(filters, strides, momentum))
+        y = tf.keras.layers.TimeDistributed(block)(temporal_shift(x))
+        x = tf.keras.layers.Add()([x, y]) if strides == 1 and x.shape[-1] == filters else y
+
+    x = tf.keras.layers.TimeDistributed(tf.keras.layers.GlobalAveragePooling2D())(x)
+    for layer in HEADS[head](n_classes):
+        x = layer(x)
+    return tf.keras.Model(inputs, x, name='TSM')
+
+def conv2plus1d(x, filters, strides=1, momentum=.9):
+    """ 3D convolution factorized in a 1x3x3 spatial and a 3x1x1 temporal one """
+    for kernel, stride in (((1, 3, 3), (1, strides, strides)), ((3, 1, 1), (1, 1, 1))):
+        x = tf.keras.layers.Conv3D(filters, kernel, strides=stride, padding='same', use_bias=False)(x)
+        x = tf.keras.layers.BatchNormalization(momentum=momentum)(x)
+        x = tf.keras.layers.ReLU()(x)
+    return x
+
+@register(CLIP_MODELS)
+def R2Plus1D(shape=(12, 100, 100, 3), n_classes=3, head='gru', momentum=.9):
+    """ (2+1)D convolutions, keeping the time resolution so the head still
+    sees one feature vector per frame """
+    inputs = tf.keras.Input(shape=shape)
+    x = inputs
+    for filters in (32, 64, 128, 256):
+        x = conv2plus1d(x, filters, 2, momentum)
+
+    x = tf.keras.layers.TimeDistributed(tf.keras.layers.GlobalAveragePooling2D())(x)
+    for layer in HEADS[head](n_classes):
+        x = layer(x)
+    return tf.keras.Model(inputs, x, name='R2Plus1D')
+
+def get_model(name, shape=(12, 100, 100, 3), n_classes=3, head='gru'):
+    """ Build the model registered under ``name``, the config['convnet'] key """
+    if name in CONVNETS:
+        return build_model(shape, n_classes, CONVNETS[name], head)
+    if name in CLIP_MODELS:
+        return CLIP_MODELS[name](shape, n_classes, head)
+    raise ValueError("Unknown convnet '{}', should be one of {}".format(name, ", ".join(list(CONVNETS) + list(CLIP_MODELS))))
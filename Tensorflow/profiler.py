@@ -0,0 +1,205 @@
+#%% Import Packages
+import os
+import csv
+import json
+import time
+import platform
+import argparse
+import numpy as np
+import multiprocessing
+
+from models import CONVNETS, CLIP_MODELS, HEADS
+
+#%% Parser
+str2bool = lambda x: (str(x).lower() == 'true')
+parser = argparse.ArgumentParser(description='Cost of the registered models on synthetic input: parameters, FLOPs, activation memory and CPU latency')
+parser.add_argument('--config', '-c', help='json config file path, for the default convnet, head and nb_frames', default='./config.json')
+parser.add_argument('--convnet', '-m', nargs='+', default=None, choices=list(CONVNETS) + list(CLIP_MODELS), help="models to profile, defaults to the convnet of the config.")
+parser.add_argument('--head', '-hd', nargs='+', default=None, choices=list(HEADS), help="temporal heads to profile, defaults to the head of the config.")
+parser.add_argument('--nb_frames', '-f', default=None, type=int, help="frames per window, defaults to nb_frames of the config.")
+parser.add_argument('--size', '-s', default=100, type=int, help="height and width of the frames.")
+parser.add_argument('--classes', '-n', default=8, type=int, help="number of classes.")
+parser.add_argument('--threads', '-t', nargs='+', default=None, type=int, help="TensorFlow intra-op thread counts to measure, defaults to 1 and all the cores.")
+parser.add_argument('--batch_sizes', '-b', nargs='+', default=[1, 8], type=int, help="windows per call to measure.")
+parser.add_argument('--runs', '-r', default=20, type=int, help="timed calls per measurement, after 3 warmup calls.")
+parser.add_argument('--layers', '-l', default=True, type=str2bool, help="print the per-layer table of each model.")
+parser.add_argument('--output', '-o', default='', help="append the results to this .csv file, to compare runs and machines.")
+args = parser.parse_args()
+
+#%% Load Main Configs
+config = {}
+if os.path.isfile(args.config):
+    with open(args.config) as jfile:
+        config = json.load(jfile)
+
+#%% Profile
+def size(shape):
+    """ Number of elements of a shape, or of a list of them for merge layers """
+    if isinstance(shape, list):
+        return sum(size(s) for s in shape)
+    return int(np.prod(shape))
+
+def layer_flops(layer, input_shape, output_shape):
+    """ Floating point operations of one call of a leaf layer, a multiply-add
+    counting as two; normalization, activations and pooling count one per
+    element they read or write """
+    import tensorflow as tf
+    L = tf.keras.layers
+    out = size(output_shape)
+    flops = 0
+    if isinstance(layer, L.DepthwiseConv2D):
+        flops = 2 * out * int(np.prod(layer.kernel_size))
+    elif isinstance(layer, (L.Conv1D, L.Conv2D, L.Conv3D)):
+        flops = 2 * out * int(np.prod(layer.kernel_size)) * input_shape[-1] // getattr(layer, 'groups', 1)
+    elif isinstance(layer, L.Dense):
+        flops = 2 * out * input_shape[-1]
+    elif isinstance(layer, L.GRU):
+        # three gates over the input and the hidden state at every step
+        batch, steps, dim = input_shape
+        flops = batch * steps * (2 * 3 * layer.units * (dim + layer.units) + 4 * 3 * layer.units)
+    elif isinstance(layer, L.BatchNormalization):
+        flops = 2 * out
+    elif isinstance(layer, (L.ReLU, L.Activation, L.Add)):
+        flops = out
+    elif isinstance(layer, (L.MaxPool2D, L.AveragePooling2D)):
+        flops = out * int(np.prod(layer.pool_size))
+    elif isinstance(layer, (L.GlobalAveragePooling1D, L.GlobalAveragePooling2D)):
+        flops = size(input_shape)
+
+    if getattr(layer, 'activation', None) is not None and getattr(layer.activation, '__name__', '') != 'linear' and not isinstance(layer, L.Activation):
+        flops += out
+    return flops
+
+def leaf_layers(layer, input_shape):
+    """ (layer, input shape, output shape) of every leaf layer of ``layer``
+    for a single window, the frames of TimeDistributed layers counted as a
+    batch like TensorFlow runs them """
+    import tensorflow as tf
+    if isinstance(layer, tf.keras.layers.TimeDistributed):
+        frames = (input_shape[0] * input_shape[1],) + tuple(input_shape[2:])
+        for leaf, i, o in leaf_layers(layer.layer, frames):
+            yield leaf, i, o
+    elif isinstance(layer, tf.keras.Sequential):
+        shape = input_shape
+        for inner in layer.layers:
+            for leaf, i, o in leaf_layers(inner, shape):
+                yield leaf, i, o
+            shape = tuple(inner.compute_output_shape(shape))
+    elif isinstance(layer, tf.keras.Model):
+        # functional models, their layers hold the symbolic shapes of the graph
+        for inner in layer.layers:
+            if isinstance(inner, tf.keras.layers.InputLayer):
+                continue
+            inputs = inner.input if isinstance(inner.input, list) else [inner.input]
+            shape = [tuple(1 if d is None else d for d in x.shape) for x in inputs]
+            shape = shape if len(shape) > 1 else shape[0]
+            for leaf, i, o in leaf_layers(inner, shape):
+                yield leaf, i, o
+    else:
+        yield layer, input_shape, tuple(layer.compute_output_shape(input_shape))
+
+def cost(model, shape):
+    """ Per-layer rows and totals for one window of ``shape`` """
+    import tensorflow as tf
+    rows = []
+    for layer, i, o in leaf_layers(model, (1,) + tuple(shape)):
+        rows.append({'layer': layer.name, 'type': type(layer).__name__, 'output': o[1:],
+                     'params': layer.count_params(), 'flops': layer_flops(layer, i, o),
+                     # float32 activations read and written by the layer, dropout passes its input through at inference
+                     'memory': 0 if isinstance(layer, tf.keras.layers.Dropout) else 4 * (size(i) + size(o))})
+    totals = {'params': model.count_params(), 'flops': sum(row['flops'] for row in rows),
+              # peak of a layer's input and output alive together, residual branches not included
+              'peak_mb': max(row['memory'] for row in rows) / 2**20}
+    return rows, totals
+
+def timing(fn, x, runs):
+    for _ in range(3):
+        fn(x)
+    times = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        fn(x)
+        times.append(time.perf_counter() - start)
+    return 1000 * float(np.median(times))
+
+def measure(name, head, shape, n_classes, threads, batch_sizes, runs):
+    """ Median latency in ms per call for each batch size, and per new frame
+    when the model streams. Runs in a fresh process, as the thread count is
+    fixed once TensorFlow starts """
+    import tensorflow as tf
+    from models import get_model
+    tf.config.threading.set_intra_op_parallelism_threads(threads)
+    tf.config.threading.set_inter_op_parallelism_threads(1)
+
+    model = get_model(name, shape, n_classes, head)
+    predict = tf.function(lambda x: model(x, training=False))
+    windows = {b: timing(predict, np.random.rand(b, *shape).astype(np.float32), runs) for b in batch_sizes}
+
+    frame = None
+    if isinstance(model.layers[0], tf.keras.layers.TimeDistributed):
+        # live loop cost: the newest frame through the encoder, then the head over the window
+        encoder = model.layers[0].layer
+        head_model = tf.keras.Sequential(model.layers[1:])
+        encode = tf.function(lambda x: encoder(x, training=False))
+        classify = tf.function(lambda x: head_model(x, training=False))
+        frame = timing(encode, np.random.rand(1, *shape[1:]).astype(np.float32), runs)
+        frame += timing(classify, np.random.rand(1, shape[0], encoder.output_shape[-1]).astype(np.float32), runs)
+    return windows, frame
+
+def print_layers(name, head, rows, totals):
+    print('\n{} + {} head, one window (shapes inside TimeDistributed are per frame)'.format(name, head))
+    print('{:28s} {:22s} {:>22s} {:>10s} {:>10s} {:>9s}'.format('layer', 'type', 'output', 'params', 'MFLOPs', 'act. MB'))
+    for row in rows:
+        print('{:28s} {:22s} {:>22s} {:>10,} {:>10.2f} {:>9.2f}'.format(row['layer'][:28], row['type'][:22], str(row['output']),
+                                                                       row['params'], row['flops'] / 1e6, row['memory'] / 2**20))
+    print('{:28s} {:22s} {:>22s} {:>10,} {:>10.2f} {:>9.2f}'.format('total', '', '', totals['params'], totals['flops'] / 1e6, totals['peak_mb']))
+
+def main():
+    import tensorflow as tf
+    from models import get_model
+
+    convnets = args.convnet or [config.get('convnet', 'ConvBatch')]
+    heads = args.head or [config.get('head', 'gru')]
+    nb_frames = args.nb_frames or config.get('nb_frames', 12)
+    threads = args.threads or sorted({1, os.cpu_count()})
+    shape = (nb_frames, args.size, args.size, 3)
+
+    results = []
+    for name in convnets:
+        for head in heads:
+            rows, totals = cost(get_model(name, shape, args.classes, head), shape)
+            if args.layers:
+                print_layers(name, head, rows, totals)
+
+            for n in threads:
+                # spawn, so every thread count starts from an uninitialized TensorFlow
+                with multiprocessing.get_context('spawn').Pool(1) as pool:
+                    windows, frame = pool.apply(measure, (name, head, shape, args.classes, n, args.batch_sizes, args.runs))
+                for batch, ms in windows.items():
+                    results.append({'convnet': name, 'head': head, 'nb_frames': nb_frames, 'size': args.size,
+                                    'params': totals['params'], 'gflops': round(totals['flops'] / 1e9, 3), 'peak_mb': round(totals['peak_mb'], 2),
+                                    'threads': n, 'batch': batch, 'ms_call': round(ms, 2), 'ms_window': round(ms / batch, 2),
+                                    'ms_frame': round(frame, 2) if frame is not None and batch == 1 else None})
+
+    print('\n{:14s} {:5s} {:>10s} {:>8s} {:>8s} {:>7s} {:>5s} {:>9s} {:>9s} {:>9s}'.format(
+          'convnet', 'head', 'params', 'GFLOPs', 'peak MB', 'threads', 'batch', 'ms/call', 'ms/window', 'ms/frame'))
+    for r in results:
+        print('{:14s} {:5s} {:>10,} {:>8.2f} {:>8.1f} {:>7d} {:>5d} {:>9.1f} {:>9.1f} {:>9s}'.format(
+              r['convnet'], r['head'], r['params'], r['gflops'], r['peak_mb'], r['threads'], r['batch'],
+              r['ms_call'], r['ms_window'], '-' if r['ms_frame'] is None else '{:.1f}'.format(r['ms_frame'])))
+
+    if args.output:
+        # the machine and versions go with every row, so files of several runs can be concatenated
+        machine = {'date': time.strftime('%Y-%m-%d %H:%M:%S'), 'host': platform.node(), 'cpu': platform.processor() or platform.machine(),
+                   'cores': os.cpu_count(), 'tensorflow': tf.__version__}
+        new = not os.path.isfile(args.output)
+        with open(args.output, 'a', newline='') as f:
+            writer = csv.DictWriter(f, fieldnames=list(machine) + list(results[0]))
+            if new:
+                writer.writeheader()
+            for r in results:
+                writer.writerow({**machine, **r})
+        print('[INFO] results appended to {}'.format(args.output))
+
+if __name__ == '__main__':
+    main()
@@ -1,5 +1,6 @@
 #%% Import Packages
 import json
+import time
 import argparse
 import pandas as pd
 import tensorflow as tf
@@ -7,8 +8,9 @@ import matplotlib.pyplot as plt
 
 from models import *
 from generator import *
+from loader import ParallelLoader
+from evaluation import CROPS, evaluate
 from keras_buoy.models import ResumableModel
-from sklearn.metrics import confusion_matrix, cohen_kappa_score
 from tensorflow.keras.preprocessing.image import ImageDataGenerator
 
 #%% Parser
@@ -17,27 +19,86 @@ parser = argparse.ArgumentParser(description='Tensorflow Jester Training using J
 parser.add_argument('--config', '-c', help='json config file path', default='./config.json')
 parser.add_argument('--eval_only', '-e', default=False, type=str2bool, help="evaluate trained model on validation data.")
 parser.add_argument('--resume', '-r', default=False, type=str2bool, help="resume training from given checkpoint.")
-parser.add_argument('--zip', '-z', default=True, type=str2bool, help="use zip file to train the model.")
+parser.add_argument('--tta_clips', '-tc', default=1, type=int, help="evaluation windows per clip, spread from its start to its end.")
+parser.add_argument('--tta_crops', '-tr', default=1, type=int, choices=range(1, len(CROPS)+1), help="evaluation crops per window, the first N of: " + ", ".join(CROPS) + ".")
+parser.add_argument('--report', '-rp', default=None, help="per-class evaluation report, defaults to <checkpoint><model_name>-validation.json.")
 args = parser.parse_args()
+if args.tta_clips < 1:
+    parser.error('--tta_clips should be at least 1')
 
 #%% Load Main Configs
 with open(args.config) as jfile:
     config = json.load(jfile)
 
 #%% Train 
+class StepRate(tf.keras.callbacks.Callback):
+    """ Log the training steps per second of each epoch, leaving out its
+    first step, which pays for tracing and compilation """
+    def __init__(self, mode):
+        super().__init__()
+        self.mode = mode
+
+    def on_epoch_begin(self, epoch, logs=None):
+        self.steps = 0
+        self.start = None
+
+    def on_train_batch_end(self, batch, logs=None):
+        self.steps += 1
+        if self.start is None:
+            self.start = time.perf_counter()
+
+    def on_epoch_end(self, epoch, logs=None):
+        if self.steps < 2:
+            return
+        rate = (self.steps - 1) / (time.perf_counter() - self.start)
+        if logs is not None:
+            logs['steps_per_second'] = rate
+        print('[INFO] epoch {}: {:.2f} steps/s ({})'.format(epoch + 1, rate, self.mode))
+
+def build(precision):
+    """ A new model of the config, compiled for the current policy """
+    optimizer = tf.keras.optimizers.Adam()
+    if precision == 'mixed_float16':
+        # float16 gradients underflow without a scaled loss
+        optimizer = tf.keras.mixed_precision.LossScaleOptimizer(optimizer)
+
+    model = get_model(config['convnet'], shape=(config['nb_frames'], 100, 100, 3), n_classes=config['num_classes'], head=config.get('head', 'gru'))
+    model.compile(optimizer=optimizer,
+                loss='CategoricalCrossentropy',
+                metrics=[tf.keras.metrics.TopKCategoricalAccuracy(k=1, name='top@1'),
+                        tf.keras.metrics.TopKCategoricalAccuracy(k=5, name='top@5')],
+                jit_compile=config.get('jit_compile', False))
+    return model
+
+def resume(path, precision):
+    """ The checkpoint at ``path`` under the ``precision`` policy. A model
+    loaded from .h5 keeps the policy it was saved with, so a checkpoint of
+    another precision has its weights (float32 variables in every policy)
+    moved to a model built for this one, whose optimizer starts over """
+    try: saved = tf.keras.models.load_model(path)
+    except Exception as e: raise RuntimeError("It was not possible to resume your model") from e
+
+    policy = next(layer for layer in saved.layers if layer.weights).dtype_policy.name
+    if policy == precision:
+        saved.jit_compile = config.get('jit_compile', False)
+        return saved
+
+    print('[INFO] checkpoint saved as {}, rebuilding it as {}'.format(policy, precision))
+    model = build(precision)
+    model.set_weights(saved.get_weights())
+    return model
+
 def main():
     global args
+
+    # mixed_bfloat16 suits CPUs with bf16 support, mixed_float16 GPUs
+    precision = config.get('precision', 'float32')
+    tf.keras.mixed_precision.set_global_policy(precision)
     
     if args.resume:
-        try: model = tf.keras.models.load_model(config['checkpoint']+config['model_name']+'.h5')
-        except: raise "It was not possible to resume your model"
-    
+        model = resume(config['checkpoint']+config['model_name']+'.h5', precision)
     else:
-        model = build_model(shape=(config['nb_frames'], 100, 100, 3), n_classes=config['num_classes'], convnet=eval(config['convnet']))
-        model.compile(optimizer='Adam',
-                    loss='CategoricalCrossentropy',
-                    metrics=[tf.keras.metrics.TopKCategoricalAccuracy(k=1, name='top@1'),
-                            tf.keras.metrics.TopKCategoricalAccuracy(k=5, name='top@5')])
+        model = build(precision)
     
     if args.eval_only:
         return validate(model)
@@ -50,7 +111,7 @@ def main():
     train = pd.read_csv(config['train_dataset'], sep=';', header=None)
     test = pd.read_csv(config['test_dataset'], sep=';', header=None)
 
-    trainGenerator = VideoFrameGenerator(path=config['data_path'],
+    trainGenerator = frame_generator(config,
                     files=train[0],
                     labels=train[1],
                     target_shape=(100,100),
@@ -58,7 +119,7 @@ def main():
                     nb_frames=config['nb_frames'],
                     batch_size=config['batch_size'])
 
-    testGenerator = VideoFrameGenerator(path=config['data_path'],
+    testGenerator = frame_generator(config,
                     files=test[0],
                     labels=test[1],
                     target_shape=(100,100),
@@ -66,14 +127,26 @@ def main():
                     nb_frames=config['nb_frames'],
                     batch_size=config['batch_size'])
 
+    trainData, testData = trainGenerator, testGenerator
+    loaders = []
+    if config.get('workers'):
+        # batches decoded by a pool of processes, ahead of the training step
+        loaders = [ParallelLoader(trainGenerator, config['workers']), ParallelLoader(testGenerator, config['workers'])]
+        trainData, testData = (loader.dataset() for loader in loaders)
+
     callbacks = [
         tf.keras.callbacks.EarlyStopping(monitor='val_loss', patience=5, restore_best_weights=True),
         tf.keras.callbacks.ReduceLROnPlateau(patience=3, factor=.2, verbose=1),
-        tf.keras.callbacks.ModelCheckpoint(config['checkpoint']+config['model_name']+'-{epoch:02d}.h5')
+        tf.keras.callbacks.ModelCheckpoint(config['checkpoint']+config['model_name']+'-{epoch:02d}.h5'),
+        StepRate('{}{}'.format(precision, ', XLA' if config.get('jit_compile') else ''))
     ]
 
     resumable_model = ResumableModel(model, save_every_epochs=1, to_path=f'{config["checkpoint"]}{config["model_name"]}.h5')
-    history = resumable_model.fit(trainGenerator,  validation_data = testGenerator, verbose=1, epochs=config['num_epochs'], callbacks=callbacks) # >= 12.5% at least
+    try:
+        history = resumable_model.fit(trainData,  validation_data = testData, verbose=1, epochs=config['num_epochs'], callbacks=callbacks) # >= 12.5% at least
+    finally:
+        for loader in loaders:
+            loader.close()
     plotHistory(history)
     
 def plotHistory(history):
@@ -101,21 +174,31 @@ def plotHistory(history):
 
 def validate(model):
     validate = pd.read_csv(config['validation_dataset'], sep=';', header=None)
-    validateGenerator = VideoFrameGenerator(path=config['data_path'],
+    validateGenerator = frame_generator(config,
                         files=validate[0],
                         labels=validate[1],
                         target_shape=(100,100),
                         transformation = ImageDataGenerator(rescale=1./255.),
                         nb_frames=config['nb_frames'],
                         batch_size=10,
-                        shuffle=False)
-    model.evaluate(validateGenerator)
-    
-    ypred = np.argmax(model.predict(validateGenerator), axis=1)
-    ytrue = np.unique(validate[1], return_inverse=True)[1]
+                        shuffle=False,
+                        keep_last=True)
+    loader = ParallelLoader(validateGenerator, config['workers']) if config.get('workers') else None
+
+    # a single pass over the data, each prediction scored against the labels of its own batch
+    try:
+        result = evaluate(model, validateGenerator, crops=args.tta_crops, clips=args.tta_clips, loader=loader)
+    finally:
+        if loader is not None:
+            loader.close()
+
+    print('Loss {:.4f} - '.format(result.loss) + ' - '.join('top@{} {:.4f}'.format(k, result.accuracy(k)) for k in result.k))
+    print('Confusion Matrix\n', result.matrix)
+    print('Cohen Kappa\n', result.kappa)
 
-    print('Confusion Matrix\n', confusion_matrix(ytrue, ypred))
-    print('Cohen Kappa\n', cohen_kappa_score(ytrue, ypred))
+    report = args.report or config['checkpoint']+config['model_name']+'-validation.json'
+    result.save(report)
+    print('[INFO] per-class report saved to {}'.format(report))
     
 if __name__ == '__main__':
     main()
\ No newline at end of file
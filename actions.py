@@ -0,0 +1,226 @@
+import os
+import sys
+import json
+import time
+import errno
+import socket
+import threading
+import configparser
+
+from pipeline import STOP, BoundedQueue
+
+# from train_data.classes_dict in train.py
+gesture_dict = {
+    'Doing other things': 0, 0: 'Doing other things',
+    'No gesture': 1, 1: 'No gesture',
+    'Stop Sign': 2, 2: 'Stop Sign',
+    'Swiping Left': 3, 3: 'Swiping Left',
+    'Swiping Right': 4, 4: 'Swiping Right',
+    'Swiping Up': 5, 5: 'Swiping Up',
+    'Turning Hand Clockwise': 6, 6: 'Turning Hand Clockwise',
+    'Turning Hand Counterclockwise': 7, 7: 'Turning Hand Counterclockwise'
+}
+
+
+def load_mapping(path: str):
+    """ Read the mapping of lower case gesture names to keyboard commands """
+    if not os.path.isfile(path):
+        raise FileNotFoundError(
+            errno.ENOENT, os.strerror(errno.ENOENT), path)
+
+    mapping = configparser.ConfigParser()
+    mapping.read(path)
+
+    # optional minimum seconds between two runs of the same action
+    rates = mapping['RATE'] if mapping.has_section('RATE') else {}
+
+    action = {}
+    for m in mapping['MAPPING']:
+        val = mapping['MAPPING'][m].split(',')
+        action[m] = {'fn': val[0], 'keys': val[1:]}  # fn: hotkey, press, typewrite
+        if m in rates:
+            action[m]['interval'] = float(rates[m])
+    return action
+
+
+def perform(action: dict):
+    """ Send the keys of a mapped action to the focused application """
+    import pyautogui
+
+    t = action['fn']
+    k = action['keys']
+    if t == 'typewrite':
+        pyautogui.typewrite(k)
+    elif t == 'press':
+        pyautogui.press(k)
+    elif t == 'hotkey':
+        for key in k:
+            pyautogui.keyDown(key)
+        for key in k[::-1]:
+            pyautogui.keyUp(key)
+        # pyautogui.hotkey(",".join(k))
+
+
+class KeyboardSink:
+    """ Injects the keys in the focused application with pyautogui. ``pause``
+    overrides the sleep pyautogui adds after each call """
+
+    def __init__(self, pause: float = None):
+        import pyautogui
+        if pause is not None:
+            pyautogui.PAUSE = pause
+
+    def __call__(self, event: dict):
+        perform(event)
+
+
+class JSONLSink:
+    """ One JSON line per action, on stdout or appended to ``path`` """
+
+    def __init__(self, path: str = None):
+        self.file = sys.stdout if path is None else open(path, 'a')
+
+    def __call__(self, event: dict):
+        self.file.write(json.dumps(event) + '\n')
+        self.file.flush()
+
+    def close(self):
+        if self.file is not sys.stdout:
+            self.file.close()
+
+
+class SocketSink:
+    """ One JSON datagram per action, to a (host, port) UDP address or a
+    Unix datagram socket path """
+
+    def __init__(self, address):
+        family = socket.AF_INET if isinstance(address, tuple) else socket.AF_UNIX
+        self.address = address
+        self.sock = socket.socket(family, socket.SOCK_DGRAM)
+
+    def __call__(self, event: dict):
+        self.sock.sendto(json.dumps(event).encode(), self.address)
+
+    def close(self):
+        self.sock.close()
+
+
+class MemorySink:
+    """ Keeps the actions in ``events``, a stand-in for headless and test runs """
+
+    def __init__(self):
+        self.events = []
+
+    def __call__(self, event: dict):
+        self.events.append(event)
+
+
+class NullSink:
+    """ Drops the actions, to measure the loop without any output """
+
+    def __call__(self, event: dict):
+        pass
+
+
+SINKS = "keyboard, stdout, memory, null, udp://HOST:PORT, unix:///PATH or a .jsonl file"
+
+
+def make_sink(spec: str):
+    """ Build a sink from its command line name, one of ``SINKS`` """
+    if spec == 'keyboard':
+        return KeyboardSink()
+    if spec == 'stdout':
+        return JSONLSink()
+    if spec == 'memory':
+        return MemorySink()
+    if spec == 'null':
+        return NullSink()
+    if spec.startswith('udp://'):
+        host, port = spec[len('udp://'):].rsplit(':', 1)
+        return SocketSink((host, int(port)))
+    if spec.startswith('unix://'):
+        return SocketSink(spec[len('unix://'):])
+    if spec.endswith('.jsonl'):
+        return JSONLSink(spec)
+    raise ValueError("unknown action sink '{}', should be one of {}".format(spec, SINKS))
+
+
+class Dispatcher:
+    """ Runs fired actions on ``sinks`` from a background thread, so the frame
+    loop never waits on input injection.
+
+    A gesture already waiting in the queue is not queued again, and one fired
+    less than ``interval`` seconds after its previous run is dropped, both
+    counted per ``source`` when several streams share the sinks. The
+    interval comes from the [RATE] section of the mapping, ``min_interval``
+    otherwise. With ``metrics`` the time spent in the sinks and the latency
+    from capture are recorded as the 'action' and 'action_latency' stages. """
+
+    def __init__(self, sinks: list, maxsize: int = 8, min_interval: float = 0., metrics=None):
+        self.sinks = sinks
+        self.min_interval = min_interval
+        self.metrics = metrics
+        self.queue = BoundedQueue(maxsize, 'drop-newest')
+        self.pending = set()
+        self.last = {}
+        self.sent = 0
+        self.coalesced = 0
+        self.limited = 0
+        self.errors = 0
+        self._lock = threading.Lock()
+        self.thread = threading.Thread(target=self.run, name='actions', daemon=True)
+        self.thread.start()
+
+    def submit(self, gesture: str, action: dict, since: float = None, source=None):
+        """ Queue ``action`` for ``gesture``, ``since`` being the perf_counter
+        time of the frame that fired it and ``source`` the stream it came
+        from, if any. Return False if it was dropped """
+        now = time.perf_counter()
+        key = (source, gesture)
+        with self._lock:
+            if key in self.pending:
+                self.coalesced += 1
+                return False
+            if key in self.last and now - self.last[key] < action.get('interval', self.min_interval):
+                self.limited += 1
+                return False
+            self.pending.add(key)
+            self.last[key] = now
+
+        event = {'time': time.time(), 'gesture': gesture, 'fn': action['fn'], 'keys': action['keys']}
+        if source is not None:
+            event['source'] = source
+        if self.queue.put((now if since is None else since, key, event)):
+            return True
+        with self._lock:
+            self.pending.discard(key)
+        return False
+
+    def run(self):
+        while True:
+            item = self.queue.get()
+            if item is STOP:
+                break
+            since, key, event = item
+            with self._lock:
+                self.pending.discard(key)
+
+            start = time.perf_counter()
+            for sink in self.sinks:
+                try:
+                    sink(event)
+                except Exception as e:
+                    self.errors += 1
+                    print('[ERROR] {} failed on {} ({})'.format(sink.__class__.__name__, event['gesture'], e))
+            self.sent += 1
+            if self.metrics is not None:
+                end = self.metrics.record('action', start)
+                self.metrics.record('action_latency', since, end)
+
+    def close(self, timeout: float = 1.0):
+        """ Run the actions still queued, then release the sinks """
+        self.queue.close()
+        self.thread.join(timeout)
+        for sink in self.sinks:
+            if hasattr(sink, 'close'):
+                sink.close()
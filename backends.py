@@ -0,0 +1,138 @@
+import numpy as np
+
+# tensorflow is imported by the functions that need it, so the list of
+# backends can be read without paying for it (e.g. to build a --help)
+
+# threads per operator of TensorFlow and of the TFLite interpreters, None- their defaults
+threads = None
+
+
+def set_threads(n: int = None):
+    """ Run each operator on ``n`` threads. Must be called before the first
+    model is built, TensorFlow fixes its thread pools when it starts """
+    global threads
+    threads = n or None
+    if threads is not None:
+        import tensorflow as tf
+        tf.config.threading.set_intra_op_parallelism_threads(threads)
+
+
+class KerasBackend:
+    """ Direct eager call of the model, skipping the ``predict`` machinery """
+    name = 'keras'
+    batched = True
+
+    def __init__(self, model, input_shape: tuple, batch_size: int = 1):
+        self.model = model
+        self.input_shape = tuple(input_shape)
+
+    def __call__(self, x):
+        return self.model(x, training=False).numpy()
+
+
+class FunctionBackend:
+    """ ``tf.function`` with a fixed (batch_size, *input_shape) signature,
+    traced once at construction. A None ``batch_size`` takes any batch """
+    name = 'function'
+    batched = True
+
+    def __init__(self, model, input_shape: tuple, batch_size: int = 1):
+        import tensorflow as tf
+
+        self.input_shape = tuple(input_shape)
+        self.fn = tf.function(lambda x: model(x, training=False),
+                              input_signature=[tf.TensorSpec((batch_size,) + self.input_shape, tf.float32)])
+        self.fn.get_concrete_function()
+
+    @classmethod
+    def restore(cls, fn, input_shape: tuple):
+        """ Wrap a function already traced, e.g. loaded from a SavedModel """
+        self = cls.__new__(cls)
+        self.input_shape = tuple(input_shape)
+        self.fn = fn
+        return self
+
+    def __call__(self, x):
+        return self.fn(x).numpy()
+
+
+def unroll(model, input_shape: tuple):
+    """ Copy of ``model`` for a fixed (1, *input_shape) input with its GRU
+    layers unrolled, so the TFLite converter only needs builtin ops """
+    import tensorflow as tf
+
+    def clone(layer):
+        config = layer.get_config()
+        if isinstance(layer, tf.keras.layers.GRU):
+            config['unroll'] = True
+        return layer.__class__.from_config(config)
+
+    inputs = tf.keras.Input(shape=tuple(input_shape), batch_size=1)
+    unrolled = tf.keras.models.clone_model(model, input_tensors=inputs, clone_function=clone)
+    unrolled.set_weights(model.get_weights())
+    return unrolled
+
+
+def tflite_converter(model, input_shape: tuple):
+    import tensorflow as tf
+    return tf.lite.TFLiteConverter.from_keras_model(unroll(model, input_shape))
+
+
+class TFLiteBackend:
+    """ TFLite interpreter whose tensors are allocated once and reused. Either
+    converts a Keras model or loads an exported ``.tflite`` file from ``path``,
+    such as the quantized models of Tensorflow/export.py """
+    name = 'tflite'
+    batched = False
+
+    def __init__(self, model=None, input_shape: tuple = None, batch_size: int = 1, path: str = None):
+        if batch_size != 1:
+            raise ValueError("TFLite models take a single sample")
+        import tensorflow as tf
+
+        if path is None:
+            self.interpreter = tf.lite.Interpreter(model_content=tflite_converter(model, input_shape).convert(), num_threads=threads)
+        else:
+            self.interpreter = tf.lite.Interpreter(model_path=path, num_threads=threads)
+        self.interpreter.allocate_tensors()
+
+        details = self.interpreter.get_input_details()[0]
+        self.input = details['index']
+        self.input_shape = tuple(details['shape'][1:])
+        self.output = self.interpreter.get_output_details()[0]['index']
+
+    def __call__(self, x):
+        self.interpreter.set_tensor(self.input, x)
+        self.interpreter.invoke()
+        return self.interpreter.get_tensor(self.output)
+
+
+# from the lowest to the highest per call overhead
+ENGINES = {
+    'tflite': TFLiteBackend,
+    'function': FunctionBackend,
+    'keras': KerasBackend,
+}
+BACKENDS = ('auto',) + tuple(ENGINES)
+
+
+def compile_model(model, input_shape: tuple, backend: str = 'auto', batch_size: int = 1, verbose: int = 1):
+    """ Wrap ``model`` in an inference backend taking (batch_size, *input_shape)
+    float32 arrays, any batch if ``batch_size`` is None. 'auto' tries the
+    backends in ``ENGINES`` order and falls back to the next one if it fails
+    to build or disagrees with the Keras model. """
+    assert backend in BACKENDS, "backend should be one of " + ", ".join(BACKENDS)
+    if backend != 'auto':
+        return ENGINES[backend](model, input_shape, batch_size)
+
+    x = np.random.rand(batch_size or 1, *input_shape).astype(np.float32)
+    expected = model(x, training=False).numpy()
+    for name, engine in ENGINES.items():
+        if batch_size != 1 and not engine.batched:
+            continue
+        try:
+            compiled = engine(model, input_shape, batch_size)
+            assert np.allclose(compiled(x), expected, atol=1e-4), "outputs differ from the Keras model"
+            return compiled
+        except Exception as e:
+            if verbose > 0: print('[INFO] {} backend is not available ({}), falling back'.format(name, e))
@@ -0,0 +1,150 @@
+import os
+import sys
+import json
+import time
+import platform
+import argparse
+import itertools
+import subprocess
+import tempfile
+import numpy as np
+
+from backends import BACKENDS
+from metrics import BUCKETS, bucket_percentiles
+
+# construct the argument parse and parse the arguments
+parser = argparse.ArgumentParser(description='Benchmark of the live loop of webcam.py over a video, headless and with null action sinks. '
+                                             'Arguments after -- are passed to webcam.py')
+parser.add_argument("-v", "--video", default='', help="Video to play, a synthetic one is written to --synthetic if empty")
+parser.add_argument("-sy", "--synthetic", default='./synthetic.mp4', help="Path of the synthetic video")
+parser.add_argument("-sd", "--seconds", type=float, default=30., help="Length of the synthetic video in seconds, at 30 frames/s")
+parser.add_argument("-cp", "--checkpoint", default="./model_best.h5", help="Location of model checkpoint file (.h5 or .tflite)")
+parser.add_argument("-m", "--mapping", default="./mapping.ini", help="Location of mapping file for gestures to commands")
+parser.add_argument("-b", "--backends", nargs='+', default=['auto'], choices=BACKENDS, help="Inference backends to measure")
+parser.add_argument("-th", "--threads", nargs='+', type=int, default=[0], help="Threads per model operator to measure (0- TensorFlow default)")
+parser.add_argument("-q", "--qsize", nargs='+', type=int, default=[20], help="Window sizes to measure")
+parser.add_argument("-sq", "--sqsize", nargs='+', type=int, default=[8], help="Smoothing lengths to measure")
+parser.add_argument("-sk", "--skip", type=int, default=30, help="Frames left out of the steady state, while the loop warms up")
+parser.add_argument("-i", "--interval", type=float, default=0.5, help="Seconds between two metrics snapshots of a run")
+parser.add_argument("-o", "--output", default='live-benchmark.jsonl', help="JSON lines file the results are appended to")
+parser.add_argument("extra", nargs=argparse.REMAINDER, help=argparse.SUPPRESS)
+
+
+def synthetic_video(path: str, seconds: float, fps: int = 30, size: tuple = (640, 480)):
+    """ A hand-sized blob moving over a noisy background, so every frame
+    passes the motion gate and reaches the model """
+    import cv2
+    rng = np.random.RandomState(0)
+    w, h = size
+    rows, cols = np.mgrid[0:h, 0:w]
+    background = (np.array([90, 110, 130]) * (0.6 + 0.4 * cols[..., None] / w)).astype(np.float32)
+
+    writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*'mp4v'), fps, size)
+    for i in range(int(seconds * fps)):
+        t = i / fps
+        x, y = w / 2 + w / 3 * np.sin(t * 4), h / 2 + h / 4 * np.sin(t * 3)
+        blob = ((cols - x)**2 + (rows - y)**2 < 100**2)[..., None]
+        frame = np.where(blob, (150, 180, 230), background) + rng.randn(h, w, 3) * 6
+        writer.write(np.clip(frame, 0, 255).astype(np.uint8))
+    writer.release()
+
+
+def run(args, video: str, backend: str, threads: int, qsize: int, sqsize: int):
+    """ Play the video through webcam.py and read its metrics snapshots.
+    The steady state starts at the first snapshot past ``--skip`` frames
+    and ends with the snapshot written at exit """
+    folder = tempfile.mkdtemp(prefix='live-benchmark-')
+    snapshot = os.path.join(folder, 'metrics.json')
+    command = [sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'webcam.py'),
+               '-v', video, '-cp', args.checkpoint, '-m', args.mapping, '-d', 'false', '-e', 'true', '-as', 'null', '-vb', '0',
+               '-b', backend, '-th', str(threads), '-q', str(qsize), '-sq', str(sqsize),
+               '-mf', snapshot, '-mi', str(args.interval)] + args.extra
+
+    snapshots = []
+    with open(os.path.join(folder, 'log.txt'), 'w') as log:
+        process = subprocess.Popen(command, stdout=log, stderr=subprocess.STDOUT)
+        while process.poll() is None:
+            time.sleep(args.interval / 2)
+            try:
+                with open(snapshot) as jfile:
+                    snapshots.append(json.load(jfile))
+            except (OSError, ValueError):
+                pass
+    if process.returncode != 0:
+        with open(os.path.join(folder, 'log.txt')) as log:
+            print('[ERROR] webcam.py failed:\n' + ''.join(log.readlines()[-20:]))
+        return None
+    with open(snapshot) as jfile:
+        snapshots.append(json.load(jfile))
+
+    frames = lambda s, stage='latency': s['stages'].get(stage, {}).get('count', 0)
+    steady = [s for s in snapshots if frames(s) >= args.skip]
+    first, last = steady[0] if steady else None, snapshots[-1]
+    if first is None or last['uptime'] - first['uptime'] <= 0:
+        print('[ERROR] no steady state in {} frames, use a longer video or a smaller --skip'.format(frames(last)))
+        return None
+
+    def percentiles(stage):
+        # the calls between the two snapshots, warmup left out
+        after, before = last['stages'].get(stage, {}).get('buckets', {}), first['stages'].get(stage, {}).get('buckets', {})
+        counts = np.zeros(BUCKETS)
+        for i, n in after.items():
+            counts[int(i)] = n - before.get(i, 0)
+        if not counts.sum():
+            return None
+        return dict(zip(('p50', 'p95', 'p99'), (1000 * p for p in bucket_percentiles(counts, (50, 95, 99)))))
+
+    elapsed = last['uptime'] - first['uptime']
+    return {'frames': frames(last) - frames(first), 'seconds': elapsed,
+            'fps': (frames(last) - frames(first)) / elapsed,
+            # the rest were left out by the motion gate
+            'inferred_percent': 100 * (frames(last, 'predict') - frames(first, 'predict')) / max(frames(last) - frames(first), 1),
+            # CPU time of all the threads over wall time, 100 is one core busy
+            'cpu_percent': 100 * (last['gauges']['cpu_seconds'] - first['gauges']['cpu_seconds']) / elapsed,
+            # from the histograms, within 5%
+            'latency_ms': percentiles('latency'),
+            'predict_ms': percentiles('predict'),
+            'dropped_frames': last['gauges'].get('dropped_frames', 0)}
+
+
+def machine():
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except OSError:
+        commit = ''
+    return {'date': time.strftime('%Y-%m-%d %H:%M:%S'), 'commit': commit, 'host': platform.node(),
+            'cpu': platform.processor() or platform.machine(), 'cores': os.cpu_count(), 'python': platform.python_version()}
+
+
+def main():
+    args = parser.parse_args()
+    args.extra = args.extra[1:] if args.extra[:1] == ['--'] else args.extra
+
+    video = args.video
+    if video == '':
+        video = args.synthetic
+        if not os.path.isfile(video):
+            synthetic_video(video, args.seconds)
+            print('[INFO] synthetic video of {:.0f}s written to {}'.format(args.seconds, video))
+
+    info = machine()
+    print('{:9}{:>8}{:>7}{:>8}{:>8}{:>9}{:>8}{:>10}{:>10}{:>10}{:>12}'.format(
+          'backend', 'threads', 'qsize', 'sqsize', 'fps', 'infer %', 'cpu %', 'p50 ms', 'p95 ms', 'p99 ms', 'predict ms'))
+    with open(args.output, 'a') as f:
+        for backend, threads, qsize, sqsize in itertools.product(args.backends, args.threads, args.qsize, args.sqsize):
+            result = run(args, video, backend, threads, qsize, sqsize)
+            if result is None:
+                continue
+            none = {'p50': 0., 'p95': 0., 'p99': 0.}
+            latency, predict = result['latency_ms'] or none, result['predict_ms'] or none
+            print('{:9}{:>8}{:>7}{:>8}{:>8.1f}{:>9.0f}{:>8.0f}{:>10.1f}{:>10.1f}{:>10.1f}{:>12.1f}'.format(
+                  backend, threads, qsize, sqsize, result['fps'], result['inferred_percent'], result['cpu_percent'],
+                  latency['p50'], latency['p95'], latency['p99'], predict['p50']), flush=True)
+            f.write(json.dumps({**info, 'video': video, 'checkpoint': args.checkpoint, 'extra': args.extra, 'backend': backend,
+                                'threads': threads, 'qsize': qsize, 'sqsize': sqsize, **result}) + '\n')
+    print('[INFO] results appended to {}'.format(args.output))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,104 @@
+import os
+import json
+import shutil
+import numpy as np
+import tensorflow as tf
+
+from backends import FunctionBackend, TFLiteBackend, tflite_converter
+from streaming import split_model, splittable
+
+# bump whenever the content of the cache changes
+VERSION = 1
+
+# traced function of each cached part
+FUNCTIONS = {'encoder': 'encode', 'head': 'classify', 'model': 'predict'}
+
+
+def traced(net, input_shape: tuple):
+    return tf.function(lambda x: net(x, training=False),
+                       input_signature=[tf.TensorSpec((None,) + tuple(input_shape), tf.float32)])
+
+
+class ModelCache:
+    """ Ready to run copies of a checkpoint, kept next to it in
+    ``<checkpoint>.cache/`` so later starts skip building, tracing and
+    converting the Keras model.
+
+    Holds a SavedModel with the whole model traced for any batch size, the
+    per-frame encoder and the temporal head when the model splits, plus the
+    TFLite conversions of the ones that match the Keras outputs. It is rebuilt when the checkpoint or
+    the window size change. """
+
+    def __init__(self, checkpoint: str, qsize: int = 20):
+        self.path = os.path.splitext(checkpoint)[0] + '.cache'
+        stat = os.stat(checkpoint)
+        self.key = {'version': VERSION, 'size': stat.st_size, 'mtime': stat.st_mtime, 'qsize': qsize}
+        self.qsize = qsize
+        self.inputs = {}
+        self._saved = None
+
+    @property
+    def valid(self):
+        try:
+            with open(os.path.join(self.path, 'cache.json')) as jfile:
+                info = json.load(jfile)
+        except (OSError, ValueError):
+            return False
+        self.inputs = {part: tuple(shape) for part, shape in info.get('inputs', {}).items()}
+        return info.get('key') == self.key
+
+    def build(self, model, verbose: int = 1):
+        """ Trace, convert and save ``model``, replacing any previous cache """
+        # a clip model only runs on the number of frames it was built for
+        window = (self.qsize,) if splittable(model) else model.input_shape[1:2]
+        parts = {'model': (model, tuple(window) + tuple(model.input_shape[2:]))}
+
+        # the models are attached to the module so the functions can reach their weights
+        module = tf.Module()
+        module.model = model
+        if splittable(model):
+            encoder, head = split_model(model)
+            parts['encoder'] = (encoder, tuple(encoder.input_shape[1:]))
+            parts['head'] = (head, (self.qsize, encoder.output_shape[-1]))
+            module.encoder, module.head = encoder, head
+
+        # written aside then renamed, so an interrupted build leaves no half cache
+        tmp = self.path + '.tmp'
+        shutil.rmtree(tmp, ignore_errors=True)
+        os.makedirs(tmp)
+        for part, (net, shape) in parts.items():
+            setattr(module, FUNCTIONS[part], traced(net, shape))
+
+            try:
+                content = tflite_converter(net, shape).convert()
+                with open(os.path.join(tmp, part + '.tflite'), 'wb') as f:
+                    f.write(content)
+                x = np.random.rand(1, *shape).astype(np.float32)
+                lite = TFLiteBackend(path=os.path.join(tmp, part + '.tflite'))
+                assert np.allclose(lite(x), net(x, training=False).numpy(), atol=1e-4), "outputs differ from the Keras model"
+            except Exception as e:
+                if verbose > 0: print('[INFO] {} is not cached as TFLite ({})'.format(part, e))
+                if os.path.isfile(os.path.join(tmp, part + '.tflite')):
+                    os.remove(os.path.join(tmp, part + '.tflite'))
+
+        tf.saved_model.save(module, os.path.join(tmp, 'saved_model'))
+        self.inputs = {part: shape for part, (_, shape) in parts.items()}
+        with open(os.path.join(tmp, 'cache.json'), 'w') as jfile:
+            json.dump({'key': self.key, 'inputs': self.inputs}, jfile, indent=2)
+
+        shutil.rmtree(self.path, ignore_errors=True)
+        os.replace(tmp, self.path)
+        self._saved = None
+
+    def load(self, part: str, backend: str = 'auto'):
+        """ Inference backend for ``part`` ('encoder', 'head' or 'model'), None
+        if the cache cannot provide ``backend`` """
+        lite = os.path.join(self.path, part + '.tflite')
+        if backend in ('auto', 'tflite') and os.path.isfile(lite):
+            return TFLiteBackend(path=lite)
+        if backend not in ('auto', 'function'):
+            return None
+
+        if self._saved is None:
+            self._saved = tf.saved_model.load(os.path.join(self.path, 'saved_model'))
+        return FunctionBackend.restore(getattr(self._saved, FUNCTIONS[part]), self.inputs[part])
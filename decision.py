@@ -0,0 +1,121 @@
+import time
+import numpy as np
+
+
+class DecisionEngine:
+    """ Turns per-frame class probabilities into gestures, in constant time per
+    frame whatever the smoothing ``window``.
+
+    Only the ``top_k`` probabilities of a frame are kept. They are smoothed by
+    a running mean over the last ``window`` frames, held in a fixed buffer
+    with a running sum, or by an exponential moving average when ``alpha`` is
+    given. A class becomes active when its smoothed score goes above its
+    ``threshold`` and stays active while it is above its ``release`` score;
+    otherwise the ``default`` class is active. A gesture fires once its class
+    has been active for ``confirm`` frames, unless it is a ``background``
+    class or the previous gesture fired less than ``cooldown`` seconds ago. """
+
+    def __init__(
+            self,
+            num_classes: int,
+            window: int = 8,
+            threshold=0.7,
+            release=None,
+            top_k: int = 5,
+            alpha: float = None,
+            confirm: int = 2,
+            cooldown: float = 0.,
+            default: int = 0,
+            background: tuple = ()):
+
+        assert window > 0, "window should be positive"
+        assert alpha is None or 0 < alpha <= 1, "alpha should be in (0, 1]"
+
+        self.num_classes = num_classes
+        self.window = window
+        self.threshold = np.broadcast_to(np.asarray(threshold, dtype=np.float64), (num_classes,))
+        self.release = self.threshold if release is None else np.broadcast_to(np.asarray(release, dtype=np.float64), (num_classes,))
+        self.top_k = min(top_k, num_classes)
+        self.alpha = alpha
+        self.confirm = confirm
+        self.cooldown = cooldown
+        self.default = default
+        self.background = set(background)
+
+        self.buffer = np.zeros((window, num_classes), dtype=np.float64)
+        self.total = np.zeros(num_classes, dtype=np.float64)
+        self.scores = np.zeros(num_classes, dtype=np.float64)
+        self._kept = np.zeros(num_classes, dtype=np.float64)
+        self.reset()
+
+    def reset(self):
+        self.buffer[:] = 0
+        self.total[:] = 0
+        self.scores[:] = 0
+        self.index = 0
+        self.count = 0
+        self.label = self.default
+        self.held = self.confirm + 1
+        self.fired_at = -np.inf
+
+    def _smooth(self, probs):
+        self._kept[:] = 0
+        top = np.argpartition(probs, -self.top_k)[-self.top_k:]
+        self._kept[top] = probs[top]
+
+        if self.alpha is not None:
+            if self.count == 0:
+                self.scores[:] = self._kept
+            else:
+                self.scores *= 1 - self.alpha
+                self.scores += self.alpha * self._kept
+            self.count = 1
+            return
+
+        slot = self.buffer[self.index]
+        self.total -= slot
+        slot[:] = self._kept
+        self.total += slot
+        self.index = (self.index + 1) % self.window
+        self.count = min(self.count + 1, self.window)
+
+        # once per lap, sum from scratch so rounding errors do not pile up
+        if self.index == 0:
+            self.buffer.sum(axis=0, out=self.total)
+        np.divide(self.total, self.count, out=self.scores)
+
+    def update(self, probs, now: float = None):
+        """ Feed the probabilities of one frame. Return the class of the fired
+        gesture, or None. ``now`` is the frame time in seconds, the clock by
+        default, which drives the cooldown """
+        self._smooth(np.asarray(probs, dtype=np.float64).reshape(-1))
+
+        candidate = int(np.argmax(self.scores))
+        if self.scores[candidate] > self.threshold[candidate]:
+            label = candidate
+        elif self.label != self.default and self.scores[self.label] > self.release[self.label]:
+            label = self.label
+        else:
+            label = self.default
+
+        if label != self.label:
+            self.label = label
+            self.held = 0
+        self.held += 1
+
+        now = time.monotonic() if now is None else now
+        if self.held == self.confirm and label not in self.background and now - self.fired_at >= self.cooldown:
+            self.fired_at = now
+            return label
+        return None
+
+    def replay(self, probs, times=None):
+        """ Run a whole (frames, classes) sequence offline. Return the
+        (frame index, class) of every fired gesture. Without ``times`` the
+        frame index is the clock, so ``cooldown`` counts frames """
+        fired = []
+        for i, p in enumerate(probs):
+            label = self.update(p, i if times is None else times[i])
+            if label is not None:
+                fired.append((i, label))
+        return fired
@@ -0,0 +1,58 @@
+import time
+import cv2
+import numpy as np
+
+
+class Display:
+    """ Debug window, an optional consumer of the frame loop.
+
+    ``show`` is called by the sink stage of the pipeline, on the main thread
+    like every HighGUI call should be. It renders at most ``fps`` items per
+    second (0- every item) and skips the others, mirroring the frame into one
+    preallocated buffer and drawing the overlay over it. Pressing 'q' in the
+    window sets ``quit``. """
+
+    def __init__(self, fps: float = 15., name: str = 'Frame', metrics=None):
+        self.interval = 1 / fps if fps > 0 else 0.
+        self.name = name
+        self.metrics = metrics
+        self.buffer = None
+        self.rendered = 0
+        self.skipped = 0
+        self.quit = False
+        self.last = -np.inf
+
+    def show(self, item: dict):
+        """ Render an item with 'frame', 'top1' and 'score', plus 'idle' and
+        'energy' when the motion gate is on, unless the last one was rendered
+        less than the frame interval ago """
+        start = time.perf_counter()
+        if start - self.last < self.interval:
+            self.skipped += 1
+            return
+        self.last = start
+
+        self.render(item)
+        if cv2.waitKey(1) & 0xFF == ord('q'):
+            self.quit = True
+        if self.metrics is not None:
+            self.metrics.record('display', start)
+
+    def render(self, item: dict):
+        frame = item['frame']
+        if self.buffer is None or self.buffer.shape != frame.shape:
+            self.buffer = np.empty_like(frame)
+        cv2.flip(frame, 1, dst=self.buffer)  # mirror image
+
+        lines = [(item['top1'] + ' %.2f' % item['score'], 0.8)]
+        if 'idle' in item:
+            lines.append((('idle' if item['idle'] else 'motion') + ' %.1f' % item['energy'], 0.6))
+        for i, (text, scale) in enumerate(lines):
+            cv2.putText(self.buffer, text, (20, 20 + 25*i), cv2.FONT_HERSHEY_DUPLEX, scale, (255, 255, 255), 2, lineType=cv2.LINE_AA)
+            cv2.putText(self.buffer, text, (20, 20 + 25*i), cv2.FONT_HERSHEY_DUPLEX, scale, (0, 0, 0), 1, lineType=cv2.LINE_AA)
+        cv2.imshow(self.name, self.buffer)
+        self.rendered += 1
+
+    def close(self):
+        if self.rendered:
+            cv2.destroyWindow(self.name)
@@ -0,0 +1,158 @@
+import os
+import json
+import math
+import time
+import threading
+import numpy as np
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# keeps a long --trace run from eating all the memory
+MAX_TRACE_EVENTS = 1000000
+
+# log-spaced histogram of every duration since the start, 10% wide buckets
+# from 0.1 ms to about 6 minutes; two snapshots of it give the percentiles of
+# the calls in between
+BUCKET_MIN = 1e-4
+BUCKET_RATIO = 1.1
+BUCKETS = 160
+_LOG_RATIO = math.log(BUCKET_RATIO)
+
+
+def bucket_percentiles(counts, quantiles):
+    """ Approximate durations at ``quantiles`` (0-100) of a histogram of
+    bucket counts, each bucket standing for its geometric center """
+    counts = np.asarray(counts, dtype=np.float64)
+    if not counts.sum():
+        return [0. for _ in quantiles]
+    cumulative = np.cumsum(counts) / counts.sum()
+    centers = BUCKET_MIN * BUCKET_RATIO ** (np.arange(len(counts)) - .5)
+    centers[0] = BUCKET_MIN
+    return [float(centers[min(np.searchsorted(cumulative, q / 100), len(counts) - 1)]) for q in quantiles]
+
+
+class StageStats:
+    """ Durations of the last ``size`` calls of a stage, plus running totals
+    and a histogram of all the calls """
+
+    def __init__(self, size: int = 1000):
+        self.samples = np.zeros(size, dtype=np.float64)
+        self.buckets = [0] * BUCKETS
+        self.count = 0
+        self.total = 0.
+
+    def add(self, seconds: float):
+        self.samples[self.count % len(self.samples)] = seconds
+        self.count += 1
+        self.total += seconds
+        bucket = int(math.log(seconds / BUCKET_MIN) / _LOG_RATIO) + 1 if seconds > BUCKET_MIN else 0
+        self.buckets[min(bucket, BUCKETS - 1)] += 1
+
+    def summary(self):
+        window = self.samples[:min(self.count, len(self.samples))]
+        p50, p95, p99 = np.percentile(window, [50, 95, 99]) if len(window) else (0., 0., 0.)
+        return {'count': self.count, 'sum': self.total, 'p50': p50, 'p95': p95, 'p99': p99,
+                # sparse, bucket index -> calls
+                'buckets': {str(i): n for i, n in enumerate(self.buckets) if n}}
+
+
+class Metrics:
+    """ Low overhead timers for the hot path.
+
+    ``record`` takes the start time of a stage and returns the end time, so
+    consecutive stages can be chained. Rolling percentiles are computed only
+    when exported, as JSON, as Prometheus text or through a local HTTP
+    endpoint. With ``trace`` every call is also kept as a Chrome trace event
+    that chrome://tracing or Perfetto can open. """
+
+    def __init__(self, window: int = 1000, trace: bool = False):
+        self.window = window
+        self.stages = {}
+        self.gauges = {}
+        self.events = [] if trace else None
+        self.started = time.perf_counter()
+
+    def record(self, name: str, start: float, end: float = None):
+        end = time.perf_counter() if end is None else end
+        stats = self.stages.get(name)
+        if stats is None:
+            stats = self.stages.setdefault(name, StageStats(self.window))
+        stats.add(end - start)
+
+        if self.events is not None and len(self.events) < MAX_TRACE_EVENTS:
+            self.events.append((name, start, end, threading.get_ident()))
+        return end
+
+    def gauge(self, name: str, fn):
+        """ Export the value returned by ``fn`` under ``name`` """
+        self.gauges[name] = fn
+
+    def summary(self):
+        return {
+            'uptime': time.perf_counter() - self.started,
+            'stages': {name: stats.summary() for name, stats in list(self.stages.items())},
+            'gauges': {name: fn() for name, fn in self.gauges.items()}
+        }
+
+    def prometheus(self, prefix: str = 'gesture'):
+        summary = self.summary()
+        lines = ['# TYPE {}_stage_seconds summary'.format(prefix)]
+        for name, stats in summary['stages'].items():
+            for key, quantile in (('p50', '0.5'), ('p95', '0.95'), ('p99', '0.99')):
+                lines.append('{}_stage_seconds{{stage="{}",quantile="{}"}} {:.6f}'.format(prefix, name, quantile, stats[key]))
+            lines.append('{}_stage_seconds_sum{{stage="{}"}} {:.6f}'.format(prefix, name, stats['sum']))
+            lines.append('{}_stage_seconds_count{{stage="{}"}} {}'.format(prefix, name, stats['count']))
+        for name, value in summary['gauges'].items():
+            lines.append('# TYPE {}_{} gauge'.format(prefix, name))
+            lines.append('{}_{} {}'.format(prefix, name, float(value)))
+        return '\n'.join(lines) + '\n'
+
+    def save(self, path: str):
+        # write then rename, so readers never see half a file
+        with open(path + '.tmp', 'w') as jfile:
+            json.dump(self.summary(), jfile, indent=2)
+        os.replace(path + '.tmp', path)
+
+    def save_trace(self, path: str):
+        events = [{'name': name, 'ph': 'X', 'pid': os.getpid(), 'tid': tid,
+                   'ts': (start - self.started) * 1e6, 'dur': (end - start) * 1e6}
+                  for name, start, end, tid in self.events or []]
+        with open(path, 'w') as jfile:
+            json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, jfile)
+
+    def export_every(self, path: str, interval: float = 5.):
+        """ Save the JSON summary to ``path`` every ``interval`` seconds on a
+        background thread """
+        def loop():
+            while True:
+                time.sleep(interval)
+                self.save(path)
+        threading.Thread(target=loop, name='metrics-export', daemon=True).start()
+
+    def serve(self, port: int, host: str = '127.0.0.1'):
+        """ Serve the Prometheus text on http://host:port/metrics """
+        metrics = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.rstrip('/') not in ('', '/metrics'):
+                    self.send_error(404)
+                    return
+                body = metrics.prometheus().encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        server = ThreadingHTTPServer((host, port), Handler)
+        threading.Thread(target=server.serve_forever, name='metrics-http', daemon=True).start()
+        return server
+
+    def print(self):
+        print('{:<16}{:>9}{:>11}{:>11}{:>11}'.format('Stage', 'Calls', 'p50 (ms)', 'p95 (ms)', 'p99 (ms)'))
+        for name, stats in self.summary()['stages'].items():
+            print('{:<16}{:>9}{:>11.2f}{:>11.2f}{:>11.2f}'.format(name, stats['count'], stats['p50']*1000, stats['p95']*1000, stats['p99']*1000))
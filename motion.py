@@ -0,0 +1,48 @@
+import cv2
+import numpy as np
+
+
+class MotionGate:
+    """ Cheap motion detector deciding which frames are worth classifying.
+
+    The motion energy is the mean absolute difference between two consecutive
+    frames, in grayscale and downscaled to ``size``. Once it stays under
+    ``threshold`` for ``hold`` frames the scene is idle and only every
+    ``idle_every``-th frame is let through (0- none); the first frame above
+    the threshold restores the full rate. """
+
+    def __init__(self, threshold: float = 2.0, idle_every: int = 10, hold: int = 20, size: tuple = (32, 24)):
+        self.threshold = threshold
+        self.idle_every = idle_every
+        self.hold = hold
+        self.size = size
+
+        self._gray = None
+        self._small = np.zeros(size[::-1], dtype=np.uint8)
+        self._prev = np.zeros(size[::-1], dtype=np.uint8)
+        self._diff = np.zeros(size[::-1], dtype=np.uint8)
+
+        self.energy = 0.
+        self.still = 0
+        self.frames = 0
+        self.skipped = 0
+
+    @property
+    def idle(self):
+        return self.still > self.hold
+
+    def __call__(self, frame):
+        """ Return True if inference should run on this frame """
+        self._gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY, dst=self._gray)
+        cv2.resize(self._gray, self.size, dst=self._small, interpolation=cv2.INTER_AREA)
+        cv2.absdiff(self._small, self._prev, dst=self._diff)
+        self._prev, self._small = self._small, self._prev
+
+        self.energy = cv2.mean(self._diff)[0] if self.frames else 0.
+        self.still = 0 if self.energy > self.threshold else self.still + 1
+        self.frames += 1
+
+        if not self.idle or (self.idle_every and (self.still - self.hold) % self.idle_every == 0):
+            return True
+        self.skipped += 1
+        return False
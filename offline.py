@@ -0,0 +1,115 @@
+import os
+import csv
+import json
+import errno
+import cv2
+import numpy as np
+
+from streaming import RingBuffer, preprocess, split_model
+
+
+def read_video(path: str, target_shape: tuple = (100, 100), batch_size: int = 64):
+    """ Decode a video file as a stream, yielding batches of up to
+    ``batch_size`` preprocessed frames with their timestamps in seconds. The
+    batch array is reused, so it is only valid until the next one """
+    cap = cv2.VideoCapture(path)
+    if not cap.isOpened():
+        raise FileNotFoundError(errno.ENOENT, os.strerror(errno.ENOENT), path)
+
+    batch = np.empty((batch_size,) + tuple(target_shape) + (3,), dtype=np.float32)
+    resized = np.empty(tuple(target_shape) + (3,), dtype=np.uint8)
+    times = []
+    while True:
+        grabbed, frame = cap.read()
+        if not grabbed:
+            break
+
+        preprocess(frame, batch[len(times)], resized)
+        times.append(cap.get(cv2.CAP_PROP_POS_MSEC) / 1000)
+        if len(times) == batch_size:
+            yield batch, times
+            times = []
+
+    cap.release()
+    if times:
+        yield batch[:len(times)], times
+
+
+def video_probabilities(model, path: str, qsize: int = 20, batch_size: int = 64):
+    """ Class probabilities of the window of ``qsize`` frames ending at every
+    frame of a video, the first windows padded with the first frame like the
+    live loop does. The encoder sees each frame once and the temporal head
+    runs over batches of windows """
+    encoder, head = split_model(model)
+
+    embeddings, times = [], []
+    for batch, t in read_video(path, encoder.input_shape[1:3], batch_size):
+        embeddings.append(encoder(batch, training=False).numpy())
+        times += t
+    if not embeddings:
+        return np.zeros((0, model.output_shape[-1]), dtype=np.float32), np.array(times)
+
+    embeddings = np.concatenate(embeddings)
+    padded = np.concatenate([np.repeat(embeddings[:1], qsize-1, axis=0), embeddings])
+    windows = np.lib.stride_tricks.sliding_window_view(padded, qsize, axis=0).transpose(0, 2, 1)
+
+    probs = [head(windows[i:i+batch_size], training=False).numpy() for i in range(0, len(windows), batch_size)]
+    return np.concatenate(probs), np.array(times)
+
+
+def clip_probabilities(predict, path: str, qsize: int = 20, batch_size: int = 64, target_shape: tuple = (100, 100)):
+    """ Same as ``video_probabilities`` for models that mix the frames of
+    their window (TSM, R2Plus1D). ``predict`` takes any batch of whole
+    windows, the windows ending at ``batch_size`` frames go through it at once """
+    history = None
+    probs, times = [], []
+    for batch, t in read_video(path, target_shape, batch_size):
+        if history is None:
+            history = np.repeat(batch[:1], qsize-1, axis=0)
+        frames = np.concatenate([history, batch])
+        windows = np.lib.stride_tricks.sliding_window_view(frames, qsize, axis=0)
+        probs.append(predict(np.ascontiguousarray(np.moveaxis(windows, -1, 1))))
+        # the batch array is reused by read_video
+        history = frames[len(frames)-(qsize-1):].copy()
+        times += t
+    if not probs:
+        return np.zeros((0, 0), dtype=np.float32), np.array(times)
+    return np.concatenate(probs), np.array(times)
+
+
+def window_probabilities(predict, path: str, qsize: int = 20, target_shape: tuple = (100, 100)):
+    """ Same as ``video_probabilities`` for models that only take a single
+    whole window, like the exported TFLite ones """
+    window = RingBuffer(qsize, tuple(target_shape) + (3,))
+    probs, times = [], []
+    for batch, t in read_video(path, target_shape):
+        for frame in batch:
+            if not probs:
+                window.fill(frame)
+            window.append(frame)
+            probs.append(predict(np.expand_dims(window.view(), axis=0))[0])
+        times += t
+    return np.array(probs), np.array(times)
+
+
+def write_results(path: str, probs, times, fired: list, names: list):
+    """ Per-frame probabilities, top class and fired gesture, as JSON lines
+    if ``path`` ends with .jsonl and as CSV otherwise """
+    fired = dict(fired)
+    top = np.argmax(probs, axis=1) if len(probs) else []
+
+    with open(path, 'w', newline='') as f:
+        if path.endswith('.jsonl'):
+            for i, p in enumerate(probs):
+                f.write(json.dumps({
+                    'frame': i,
+                    'time': round(float(times[i]), 4),
+                    'probs': dict(zip(names, np.round(p.astype(np.float64), 6).tolist())),
+                    'top1': names[top[i]],
+                    'fired': names[fired[i]] if i in fired else None
+                }) + '\n')
+        else:
+            writer = csv.writer(f)
+            writer.writerow(['frame', 'time'] + names + ['top1', 'fired'])
+            for i, p in enumerate(probs):
+                writer.writerow([i, '%.4f' % times[i]] + ['%.6f' % v for v in p] + [names[top[i]], names[fired[i]] if i in fired else ''])
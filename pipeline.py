@@ -0,0 +1,178 @@
+import threading
+from collections import deque
+
+# returned by a stage function (or by an empty, closed queue) to end the pipeline
+STOP = object()
+
+POLICIES = ('drop-oldest', 'drop-newest', 'block')
+
+
+class BoundedQueue:
+    """ Thread safe FIFO holding at most ``maxsize`` items.
+
+    When it is full, ``put`` follows ``policy``: 'drop-oldest' discards the
+    oldest waiting item, 'drop-newest' discards the new one and 'block' waits
+    for room. Once closed, ``get`` returns the remaining items and then STOP.
+    ``notify`` is set whenever an item arrives or the queue closes, so a single
+    consumer can wait on several queues. """
+
+    def __init__(self, maxsize: int = 2, policy: str = 'drop-oldest', notify: threading.Event = None):
+        assert policy in POLICIES, "policy should be one of " + ", ".join(POLICIES)
+        assert maxsize > 0, "maxsize should be positive"
+
+        self.maxsize = maxsize
+        self.policy = policy
+        self.items = deque()
+        self.closed = False
+        self.dropped = 0
+        self.notify = notify
+        self._cond = threading.Condition()
+
+    def put(self, item):
+        """ Return False if the item was not queued """
+        with self._cond:
+            if self.policy == 'block':
+                while len(self.items) >= self.maxsize and not self.closed:
+                    self._cond.wait()
+            if self.closed:
+                return False
+
+            if len(self.items) >= self.maxsize:
+                self.dropped += 1
+                if self.policy == 'drop-newest':
+                    return False
+                self.items.popleft()
+
+            self.items.append(item)
+            self._cond.notify_all()
+            if self.notify is not None:
+                self.notify.set()
+            return True
+
+    def get(self):
+        with self._cond:
+            while not self.items and not self.closed:
+                self._cond.wait()
+            if not self.items:
+                return STOP
+
+            item = self.items.popleft()
+            self._cond.notify_all()
+            return item
+
+    def close(self, drain: bool = True):
+        """ Stop accepting items. Unless ``drain``, pending items are discarded """
+        with self._cond:
+            self.closed = True
+            if not drain:
+                self.items.clear()
+            self._cond.notify_all()
+            if self.notify is not None:
+                self.notify.set()
+
+    def __len__(self):
+        return len(self.items)
+
+
+class Stage(threading.Thread):
+    """ Calls ``fn`` on every item of ``inbox`` and puts the results in
+    ``outbox``. Without an inbox ``fn`` takes no argument and acts as the
+    source. ``fn`` returns None to emit nothing and STOP to end the stage. """
+
+    def __init__(self, fn, inbox: BoundedQueue = None, outbox: BoundedQueue = None, name: str = None):
+        super().__init__(name=name, daemon=True)
+        self.fn = fn
+        self.inbox = inbox
+        self.outbox = outbox
+        self.error = None
+
+    def run(self):
+        try:
+            while not (self.outbox is not None and self.outbox.closed):
+                if self.inbox is None:
+                    item = self.fn()
+                else:
+                    item = self.inbox.get()
+                    if item is STOP:
+                        break
+                    item = self.fn(item)
+
+                if item is STOP:
+                    break
+                if item is not None and self.outbox is not None:
+                    self.outbox.put(item)
+
+        except Exception as e:
+            self.error = e
+
+        finally:
+            # let the downstream stages finish what is already queued
+            if self.outbox is not None:
+                self.outbox.close()
+
+
+class Pipeline:
+    """ source -> stages -> sink, connected by bounded queues.
+
+    ``policy`` applies to the queue after the source, the queues between the
+    later stages block when full. The source and every intermediate stage run
+    on their own thread; the sink runs on the calling thread, since OpenCV
+    windows should be driven from the main thread. The pipeline ends when the source is exhausted and the queues
+    are drained, or as soon as any function returns STOP. """
+
+    def __init__(self, source, stages: list, sink, maxsize: int = 2, policy: str = 'drop-oldest'):
+        self.source = source
+        self.stages = stages
+        self.sink = sink
+        # only frames are dropped: later items carry results, such as a fired
+        # gesture whose cooldown has already started, and wait for room instead
+        self.queues = [BoundedQueue(maxsize, policy)] + [BoundedQueue(maxsize, 'block') for _ in range(len(stages))]
+        self.threads = []
+
+    @property
+    def dropped(self):
+        return sum(queue.dropped for queue in self.queues)
+
+    def run(self, threaded: bool = True):
+        if not threaded:
+            return self._run_serial()
+
+        self.threads = [Stage(self.source, outbox=self.queues[0], name='source')]
+        for i, fn in enumerate(self.stages):
+            self.threads.append(Stage(fn, self.queues[i], self.queues[i+1], name=getattr(fn, '__name__', None)))
+
+        for thread in self.threads:
+            thread.start()
+
+        try:
+            while True:
+                item = self.queues[-1].get()
+                if item is STOP or self.sink(item) is STOP:
+                    break
+        finally:
+            self.stop()
+
+    def _run_serial(self):
+        while True:
+            item = self.source()
+            for fn in self.stages:
+                if item is None or item is STOP:
+                    break
+                item = fn(item)
+
+            if item is STOP:
+                break
+            if item is not None and self.sink(item) is STOP:
+                break
+
+    def stop(self, timeout: float = 1.0):
+        """ Abort all stages, discarding queued items, and re-raise the first
+        error one of them hit """
+        for queue in self.queues:
+            queue.close(drain=False)
+        for thread in self.threads:
+            thread.join(timeout)
+
+        for thread in self.threads:
+            if thread.error is not None:
+                raise thread.error
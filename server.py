@@ -0,0 +1,218 @@
+import sys
+import time
+import argparse
+import threading
+import numpy as np
+import tensorflow as tf
+
+from imutils.video import VideoStream, FileVideoStream
+
+from actions import SINKS, Dispatcher, gesture_dict, load_mapping, make_sink
+from backends import BACKENDS, compile_model
+from decision import DecisionEngine
+from metrics import Metrics
+from motion import MotionGate
+from pipeline import POLICIES, STOP, BoundedQueue, Stage
+from streaming import RingBuffer, preprocess, split_model
+
+qsize = 20
+sqsize = 8
+num_classes = 8
+threshold = 0.7
+
+# construct the argument parse and parse the arguments
+str2bool = lambda x: (str(x).lower() == 'true')
+parser = argparse.ArgumentParser(description='Gesture recognition over several video sources sharing one model')
+parser.add_argument("-s", "--sources", nargs='+', default=['0'], help="Webcam indexes and/or video files to read")
+parser.add_argument("-e", "--execute", type=str2bool, default=False, help="Bool indicating whether to map output to keyboard/mouse commands")
+parser.add_argument("-as", "--action_sinks", nargs='+', default=['keyboard'], help="Where fired actions go with --execute: " + SINKS)
+parser.add_argument("-ai", "--action_interval", type=float, default=0., help="Minimum seconds between two runs of the same action, unless set in the [RATE] section of the mapping")
+parser.add_argument("-vb", "--verbose", type=int, default=1, help="Verbosity mode. 0- Silent. 1- Print info messages. 2- Print info and debug messages")
+parser.add_argument("-cp", "--checkpoint", default="./model_best.h5", help="Location of model checkpoint file")
+parser.add_argument("-m", "--mapping", default="./mapping.ini", help="Location of mapping file for gestures to commands")
+parser.add_argument("-b", "--backend", default='auto', choices=BACKENDS, help="Inference backend. auto picks the one with the lowest overhead that works")
+parser.add_argument("-mw", "--max_wait", type=float, default=10., help="Milliseconds to wait for the other streams once a first one has a frame ready")
+parser.add_argument("-o", "--overload", default=None, choices=POLICIES, help="What a full stream queue does with a new frame. Defaults to drop-oldest for webcams and block for video files")
+parser.add_argument("-mg", "--motion_gate", type=str2bool, default=True, help="Thin out inference while the scene of a stream is still")
+parser.add_argument("-mt", "--motion_threshold", type=float, default=2.0, help="Mean absolute frame difference (0-255) that counts as motion")
+parser.add_argument("-ie", "--idle_every", type=int, default=10, help="While idle, classify only every N-th frame (0- none)")
+parser.add_argument("-rl", "--release", type=float, default=0.6, help="Smoothed score under which an active gesture is released")
+parser.add_argument("-cd", "--cooldown", type=float, default=0.5, help="Minimum time in seconds between two fired gestures of a stream")
+parser.add_argument("-mf", "--metrics", default='', help="Save per-stage latency percentiles to this JSON file at exit")
+
+
+class Stream:
+    """ One video source with its own capture thread, embedding window,
+    motion gate and gesture decisions """
+
+    def __init__(self, index: int, source: str, dim: int, ready: threading.Event, args):
+        self.index = index
+        self.source = source
+        if source.isdigit():
+            self.vs = VideoStream(int(source), usePiCamera=False).start()
+        else:
+            self.vs = FileVideoStream(source).start()
+
+        # a video file has no frame rate to keep up with, so it should not drop frames
+        policy = args.overload or ('drop-oldest' if source.isdigit() else 'block')
+        self.queue = BoundedQueue(1, policy, notify=ready)
+        self.embeddings = RingBuffer(qsize, (dim,))
+        self.gate = MotionGate(args.motion_threshold, args.idle_every, hold=qsize) if args.motion_gate else None
+        self.engine = DecisionEngine(num_classes, sqsize, threshold, release=args.release, confirm=2, cooldown=args.cooldown,
+                                     background=(gesture_dict['Doing other things'], gesture_dict['No gesture']))
+
+        self.frame = None
+        self.frames = 0
+        self.fired = 0
+        self.failed = False
+        self.reader = Stage(self.read, outbox=self.queue, name='stream-{}'.format(index))
+
+    @property
+    def finished(self):
+        return self.queue.closed and not len(self.queue)
+
+    def read(self):
+        # the webcam thread keeps handing back the same array until a new frame arrives
+        last, self.frame = self.frame, self.vs.read()
+        while self.frame is last and self.frame is not None:
+            time.sleep(.001)
+            self.frame = self.vs.read()
+
+        if self.frame is None:
+            return STOP
+        if self.gate is not None and not self.gate(self.frame):
+            return None
+        return time.perf_counter(), self.frame
+
+    def check(self):
+        """ Report and close the stream once its reader stage has failed,
+        the other streams carry on """
+        if self.reader.error is not None and not self.failed:
+            self.failed = True
+            print('[ERROR] stream {} ({}) stopped: {!r}'.format(self.index, self.source, self.reader.error))
+            self.stop()
+
+    def stop(self):
+        self.queue.close(drain=False)
+        self.vs.stop()
+
+
+def collect(streams: list, ready: threading.Event, max_wait: float):
+    """ Wait for a first stream to have a frame, then up to ``max_wait``
+    seconds for the others. Return the (stream, item) ready, or None once
+    every stream has ended """
+    deadline = None
+    while True:
+        ready.clear()
+        for stream in streams:
+            stream.check()
+        live = [stream for stream in streams if not stream.finished]
+        if not live:
+            return None
+
+        waiting = [stream for stream in live if len(stream.queue)]
+        if waiting:
+            deadline = deadline or time.perf_counter() + max_wait
+            if len(waiting) == len(live) or time.perf_counter() >= deadline:
+                return [(stream, stream.queue.get()) for stream in waiting]
+            ready.wait(max(deadline - time.perf_counter(), 0))
+        else:
+            ready.wait()
+
+
+def main():
+    args = parser.parse_args()
+    verbose = args.verbose
+    action = load_mapping(args.mapping)
+    sinks = [make_sink(spec) for spec in args.action_sinks] if args.execute else []
+
+    # one copy of the model and one TF runtime for every stream
+    model = tf.keras.models.load_model(args.checkpoint)
+    encoder, head = split_model(model)
+    dim = encoder.output_shape[-1]
+    shape = encoder.input_shape[1:]
+    encode = compile_model(encoder, shape, args.backend, batch_size=None, verbose=verbose)
+    classify = compile_model(head, (qsize, dim), args.backend, batch_size=None, verbose=verbose)
+
+    ready = threading.Event()
+    streams = [Stream(i, source, dim, ready, args) for i, source in enumerate(args.sources)]
+    if verbose > 0: print('[INFO] Serving {} streams'.format(len(streams)))
+
+    inputs = np.zeros((len(streams),) + tuple(shape), dtype=np.float32)
+    windows = np.zeros((len(streams), qsize, dim), dtype=np.float32)
+    resized = np.zeros(shape, dtype=np.uint8)
+    metrics = Metrics()
+    dispatcher = Dispatcher(sinks, min_interval=args.action_interval, metrics=metrics) if sinks else None
+    batches = 0
+
+    for stream in streams:
+        stream.reader.start()
+
+    start = time.perf_counter()
+    try:
+        while True:
+            batch = collect(streams, ready, args.max_wait / 1000)
+            if batch is None:
+                break
+
+            t = time.perf_counter()
+            n = len(batch)
+            for i, (stream, (_, frame)) in enumerate(batch):
+                preprocess(frame, inputs[i], resized)
+            t = metrics.record('preprocess', t)
+
+            embeddings = encode(inputs[:n])
+            for i, (stream, _) in enumerate(batch):
+                if stream.frames == 0:
+                    stream.embeddings.fill(embeddings[i])
+                else:
+                    stream.embeddings.append(embeddings[i])
+                windows[i] = stream.embeddings.view()
+                stream.frames += 1
+            probs = classify(windows[:n])
+            t = metrics.record('predict', t)
+            batches += 1
+
+            # each result goes back to the smoothing and actions of its own stream
+            for i, (stream, (captured, _)) in enumerate(batch):
+                fired = stream.engine.update(probs[i])
+                if fired is None:
+                    continue
+
+                stream.fired += 1
+                gesture = gesture_dict[fired].lower()
+                if verbose > 0: print('[INFO] stream {}: {}'.format(stream.index, gesture_dict[fired]))
+                if dispatcher is not None and gesture in action.keys():
+                    # coalesced and rate limited per stream, clients do not throttle each other
+                    dispatcher.submit(gesture, action[gesture], captured, source=stream.index)
+            metrics.record('decide', t)
+
+    except KeyboardInterrupt:
+        pass
+
+    finally:
+        for stream in streams:
+            stream.stop()
+        if dispatcher is not None:
+            dispatcher.close()
+
+    for stream in streams:
+        stream.check()
+    elapsed = time.perf_counter() - start
+    frames = sum(stream.frames for stream in streams)
+    print("[INFO] elasped time: {:.2f}".format(elapsed))
+    print("[INFO] {} frames in {} batches, mean batch size {:.2f}, {:.2f} frames/s".format(
+        frames, batches, frames / max(batches, 1), frames / elapsed))
+    if verbose > 0:
+        for stream in streams:
+            skipped = stream.gate.skipped if stream.gate is not None else 0
+            print("[INFO] stream {} ({}): {} frames, {} skipped, {} gestures".format(stream.index, stream.source, stream.frames, skipped, stream.fired))
+        if dispatcher is not None:
+            print("[INFO] actions: {} sent, {} coalesced, {} rate limited".format(dispatcher.sent, dispatcher.coalesced, dispatcher.limited))
+        metrics.print()
+    if args.metrics: metrics.save(args.metrics)
+    if any(stream.failed for stream in streams):
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,177 @@
+import cv2
+import numpy as np
+import tensorflow as tf
+
+from backends import compile_model
+
+
+class RingBuffer:
+    """ Fixed size FIFO over a preallocated array.
+
+    Every item is written twice, at ``i`` and ``i + size``, so ``view`` can
+    return the last ``size`` items oldest first without copying them. """
+
+    def __init__(self, size: int, shape: tuple, dtype=np.float32):
+        self.size = size
+        self.data = np.zeros((2 * size,) + tuple(shape), dtype=dtype)
+        self.start = 0
+
+    def append(self, item):
+        """ Overwrite the oldest item """
+        self.data[self.start] = item
+        self.data[self.start + self.size] = item
+        self.start = (self.start + 1) % self.size
+
+    def fill(self, item):
+        """ Set every slot to the same item """
+        self.data[:] = item
+        self.start = 0
+
+    def latest(self):
+        return self.data[self.start + self.size - 1]
+
+    def view(self):
+        return self.data[self.start:self.start + self.size]
+
+
+def preprocess(frame, out, resized):
+    """ Resize a raw uint8 frame into the ``resized`` scratch buffer and scale
+    it to [0, 1] into ``out``, both preallocated with the target shape """
+    cv2.resize(frame, resized.shape[1::-1], dst=resized, interpolation=cv2.INTER_LINEAR)
+    np.multiply(resized, 1/255, out=out, casting='unsafe')
+
+
+class FrameRing(RingBuffer):
+    """ Window of preprocessed frames. Each captured frame is resized and
+    scaled to [0, 1] exactly once, straight into the preallocated slots. """
+
+    def __init__(self, size: int, target_shape: tuple = (100, 100), nb_channel: int = 3):
+        super().__init__(size, tuple(target_shape) + (nb_channel,))
+        self.target_shape = target_shape
+        self._resized = np.empty(tuple(target_shape) + (nb_channel,), dtype=np.uint8)
+
+    def append(self, frame):
+        """ Preprocess a raw (H, W, C) uint8 frame over the oldest slot """
+        preprocess(frame, self.data[self.start], self._resized)
+        self.data[self.start + self.size] = self.data[self.start]
+        self.start = (self.start + 1) % self.size
+
+    def fill(self, frame):
+        preprocess(frame, self.data[0], self._resized)
+        self.data[1:] = self.data[0]
+        self.start = 0
+
+
+def splittable(model):
+    """ Whether the frames go through the model independently up to the
+    temporal head, so each one can be encoded once. Not the case of the clip
+    models of Tensorflow/models.py (TSM, R2Plus1D), which mix the frames """
+    return isinstance(model.layers[0], tf.keras.layers.TimeDistributed)
+
+
+def split_model(model):
+    """ Split a checkpoint made by ``build_model`` into the per-frame encoder
+    (the network wrapped by ``TimeDistributed``) and the temporal head
+    (GRU + Dense stack), sharing the trained weights. """
+    assert splittable(model), "Model should start with a TimeDistributed encoder"
+    td = model.layers[0]
+
+    encoder = td.layer
+    inputs = tf.keras.Input(shape=(None, encoder.output_shape[-1]))
+    x = inputs
+    for layer in model.layers[1:]:
+        x = layer(x)
+    head = tf.keras.Model(inputs, x)
+    return encoder, head
+
+
+class StatefulHead:
+    """ Step-wise copy of the temporal head. The GRU cell consumes one
+    embedding per call and carries its hidden state between calls, so a
+    frame costs O(1) instead of replaying the whole window.
+
+    The carried state sees every frame since the last re-sync rather than
+    just the last ``qsize`` ones; every ``resync_every`` steps it is rebuilt
+    from the embedding window so the drift from the trained behaviour stays
+    bounded. ``resync_every=0`` never re-syncs. """
+
+    def __init__(self, head, resync_every: int = 20, backend: str = 'keras'):
+        grus = [i for i, layer in enumerate(head.layers) if isinstance(layer, tf.keras.layers.GRU)]
+        assert len(grus) == 1, "Head should have a single GRU layer"
+
+        self.gru = head.layers[grus[0]]
+        self.cell = self.gru.cell
+
+        inputs = tf.keras.Input(shape=(self.gru.units,))
+        x = inputs
+        for layer in head.layers[grus[0]+1:]:
+            x = layer(x)
+        self.tail = compile_model(tf.keras.Model(inputs, x), (self.gru.units,), backend)
+
+        self.resync_every = resync_every
+        self.state = None
+        self.steps = 0
+
+    def resync(self, window):
+        """ Rebuild the hidden state from a full (qsize, D) window """
+        self.state = self.gru(np.expand_dims(window, axis=0), training=False)
+        self.steps = 0
+
+    def step(self, embedding):
+        self.state, _ = self.cell(np.expand_dims(embedding, axis=0), [self.state], training=False)
+
+    def __call__(self, embeddings: RingBuffer):
+        self.steps += 1
+        if self.state is None or (self.resync_every and self.steps >= self.resync_every):
+            self.resync(embeddings.view())
+        else:
+            self.step(embeddings.latest())
+        return self.tail(self.state.numpy())
+
+
+class StreamingModel:
+    """ Runs the encoder only on the newest frame and keeps the embeddings of
+    the last ``qsize`` frames, so each call costs one frame of conv work plus
+    the temporal head. With ``stateful`` the head itself is replaced by a
+    ``StatefulHead`` that advances one step per frame. Encoder and head run
+    on the given inference ``backend``. """
+
+    def __init__(self, model, qsize: int = 20, stateful: bool = False, resync_every: int = 20, backend: str = 'keras'):
+        self.encoder, self.head = split_model(model)
+        dim = self.encoder.output_shape[-1]
+        self.embeddings = RingBuffer(qsize, (dim,))
+
+        self._encode = compile_model(self.encoder, self.encoder.input_shape[1:], backend)
+        if stateful:
+            self.stateful = StatefulHead(self.head, resync_every, backend)
+        else:
+            self.stateful = None
+            self._head = compile_model(self.head, (qsize, dim), backend)
+
+    @classmethod
+    def from_backends(cls, encode, head, qsize: int = 20):
+        """ Streaming over an already compiled encoder and (qsize, D) head,
+        such as the ones of a ``ModelCache``, without the Keras model """
+        self = cls.__new__(cls)
+        self.encoder = self.head = self.stateful = None
+        self.embeddings = RingBuffer(qsize, (head.input_shape[-1],))
+        self._encode = encode
+        self._head = head
+        return self
+
+    def encode(self, frame):
+        return self._encode(np.expand_dims(frame, axis=0))[0]
+
+    def fill(self, frame):
+        """ Initialize the whole window with a single frame """
+        self.embeddings.fill(self.encode(frame))
+        if self.stateful is not None:
+            self.stateful.resync(self.embeddings.view())
+
+    def __call__(self, frame):
+        """ Push a preprocessed (H, W, C) frame and return the class
+        probabilities for the current window, shaped like ``model.predict`` """
+        self.embeddings.append(self.encode(frame))
+        if self.stateful is not None:
+            return self.stateful(self.embeddings)
+        return self._head(np.expand_dims(self.embeddings.view(), axis=0))
@@ -0,0 +1,128 @@
+import os
+import sys
+from collections import deque
+
+import numpy as np
+import pytest
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from decision import DecisionEngine
+
+NUM_CLASSES = 8
+BACKGROUND = (0, 1)
+
+
+def old_decisions(probs, sqsize=8, threshold=0.7, k=5):
+    """ The SQ/act smoothing of webcam.py before DecisionEngine, returning the
+    (frame index, class) of every gesture it fired outside the background """
+    SQ = deque(maxlen=sqsize)
+    act = deque([1, 1], maxlen=3)
+    fired = []
+    for i, pred in enumerate(probs):
+        kth = pred.argpartition(-k)[::-1][:k]
+        hist = np.zeros(NUM_CLASSES)
+        hist[kth] = pred[kth]
+        SQ.append(hist)
+
+        ave_pred = np.array(SQ).mean(axis=0)
+        top1 = int(np.argmax(ave_pred)) if max(ave_pred) > threshold else 0
+        act.append(top1)
+        if act[0] != act[1] and len(set(list(act)[1:])) == 1 and top1 not in BACKGROUND:
+            fired.append((i, top1))
+    return fired
+
+
+def gesture_sequence(seed, frames=400):
+    """ Noisy probabilities made of segments where one class dominates """
+    rng = np.random.RandomState(seed)
+    probs = []
+    while len(probs) < frames:
+        label, length = rng.randint(NUM_CLASSES), rng.randint(2, 20)
+        peak = rng.uniform(.3, 1.)
+        for _ in range(length):
+            p = rng.dirichlet(np.ones(NUM_CLASSES)) * (1 - peak)
+            p[label] += peak
+            probs.append(p)
+    return np.array(probs[:frames])
+
+
+def one_hot(label, score):
+    p = np.full(NUM_CLASSES, (1 - score) / (NUM_CLASSES - 1))
+    p[label] = score
+    return p
+
+
+@pytest.mark.parametrize('seed', range(5))
+@pytest.mark.parametrize('sqsize', [1, 4, 8])
+def test_matches_old_smoothing(seed, sqsize):
+    probs = gesture_sequence(seed)
+    engine = DecisionEngine(NUM_CLASSES, sqsize, 0.7, confirm=2, background=BACKGROUND)
+    expected = old_decisions(probs, sqsize)
+    assert expected, "the sequence should fire some gestures"
+    assert engine.replay(probs) == expected
+
+
+def test_running_mean_over_window():
+    probs = gesture_sequence(0, frames=50)
+    engine = DecisionEngine(NUM_CLASSES, window=6, top_k=3)
+    kept = []
+    for p in probs:
+        engine.update(p, 0.)
+        top = np.zeros(NUM_CLASSES)
+        top[np.argsort(p)[-3:]] = p[np.argsort(p)[-3:]]
+        kept.append(top)
+        np.testing.assert_allclose(engine.scores, np.mean(kept[-6:], axis=0), atol=1e-12)
+
+
+def test_ema():
+    probs = gesture_sequence(1, frames=30)
+    engine = DecisionEngine(NUM_CLASSES, top_k=NUM_CLASSES, alpha=0.25)
+    expected = probs[0]
+    for i, p in enumerate(probs):
+        engine.update(p, 0.)
+        if i > 0:
+            expected = 0.75 * expected + 0.25 * p
+        np.testing.assert_allclose(engine.scores, expected)
+
+
+def test_hysteresis():
+    engine = DecisionEngine(NUM_CLASSES, window=1, threshold=0.7, release=0.4, confirm=1)
+    # under the threshold nothing is active
+    assert engine.update(one_hot(3, 0.6), 0.) is None
+    assert engine.label == 0
+    # above it the class enters, and stays while above the release score
+    assert engine.update(one_hot(3, 0.8), 1.) == 3
+    assert engine.update(one_hot(3, 0.5), 2.) is None
+    assert engine.label == 3
+    # under the release score it exits
+    engine.update(one_hot(3, 0.3), 3.)
+    assert engine.label == 0
+    # and has to go above the threshold again to re-enter
+    engine.update(one_hot(3, 0.6), 4.)
+    assert engine.label == 0
+
+
+def test_confirm_fires_once():
+    engine = DecisionEngine(NUM_CLASSES, window=1, confirm=3)
+    fired = engine.replay([one_hot(4, 0.9)] * 10)
+    assert fired == [(2, 4)]
+
+
+def test_background_never_fires():
+    engine = DecisionEngine(NUM_CLASSES, window=1, confirm=1, background=BACKGROUND)
+    assert engine.replay([one_hot(1, 0.9)] * 5) == []
+
+
+def test_cooldown():
+    engine = DecisionEngine(NUM_CLASSES, window=1, confirm=1, cooldown=0.5)
+    probs = [one_hot(3, 0.9), one_hot(0, 0.9), one_hot(4, 0.9), one_hot(0, 0.9), one_hot(5, 0.9)]
+    # the swipe at 0.3s comes too soon after the one at 0s, the one at 0.6s does not
+    assert engine.replay(probs, [0., 0.1, 0.3, 0.4, 0.6]) == [(0, 3), (4, 5)]
+
+
+def test_reset():
+    engine = DecisionEngine(NUM_CLASSES, window=4, confirm=1)
+    engine.update(one_hot(3, 0.9), 0.)
+    engine.reset()
+    assert engine.label == 0 and not engine.scores.any()
+    assert engine.update(one_hot(3, 0.9), 0.) == 3
@@ -1,95 +1,209 @@
-import cv2
-import numpy as np
 import time
+started = time.perf_counter()
+
 import os
+import sys
 import errno
+import argparse
+import numpy as np
 
-import tensorflow as tf
+# cv2 (with imutils, the display and the motion gate) and tensorflow are imported
+# once the arguments and the checkpoint are checked, so --help and configuration
+# errors do not wait for them; the modules below only need numpy
 #import torch
 #from torch.nn import functional as F
 #from torch.autograd import Variable as V
 #from torchvision.transforms import Compose, CenterCrop, ToPILImage, ToTensor, Normalize
-from collections import OrderedDict, deque
 
 #from model import ConvColumn
 #import torch.nn as nn
-import json
 
-import imutils
-from imutils.video import VideoStream, FileVideoStream, WebcamVideoStream, FPS
-import argparse
-import pyautogui
-import configparser
+from actions import SINKS, Dispatcher, gesture_dict, load_mapping, make_sink
+from backends import BACKENDS
+from decision import DecisionEngine
+from metrics import Metrics
+from pipeline import POLICIES, STOP, Pipeline
 
 qsize = 20
 sqsize = 8
 num_classes = 8
 threshold = 0.7
 
-# from train_data.classes_dict in train.py
-gesture_dict = {
-    'Doing other things': 0, 0: 'Doing other things',
-    'No gesture': 1, 1: 'No gesture', 
-    'Stop Sign': 2, 2: 'Stop Sign', 
-    'Swiping Left': 3, 3: 'Swiping Left', 
-    'Swiping Right': 4, 4: 'Swiping Right', 
-    'Swiping Up': 5, 5: 'Swiping Up', 
-    'Turning Hand Clockwise': 6, 6: 'Turning Hand Clockwise', 
-    'Turning Hand Counterclockwise': 7, 7: 'Turning Hand Counterclockwise'
-}
-
 # construct the argument parse and parse the arguments
 str2bool = lambda x: (str(x).lower() == 'true')
 parser = argparse.ArgumentParser()
 # parser.add_argument('model')nppnpp
 parser.add_argument("-e", "--execute", type=str2bool, default=True, help="Bool indicating whether to map output to keyboard/mouse commands")
 parser.add_argument("-d", "--debug", type=str2bool, default=True, help="In debug mode, show webcam input")
+parser.add_argument("-df", "--display_fps", type=float, default=15., help="In debug mode, maximum frame rate of the webcam window (0- no limit)")
 parser.add_argument("-v", "--video", default='test.mp4', help="Path to video file if using an offline file")
-parser.add_argument("-vb", "--verbose", default=2, help="Verbosity mode. 0- Silent. 1- Print info messages. 2- Print info and debug messages")
-parser.add_argument("-cp", "--checkpoint", default="./model_best.h5", help="Location of model checkpoint file")
+parser.add_argument("-vb", "--verbose", type=int, default=2, help="Verbosity mode. 0- Silent. 1- Print info messages. 2- Print info and debug messages")
+parser.add_argument("-cp", "--checkpoint", default="./model_best.h5", help="Location of model checkpoint file (.h5 or .tflite)")
 parser.add_argument("-m", "--mapping", default="./mapping.ini", help="Location of mapping file for gestures to commands")
+parser.add_argument("-b", "--backend", default='auto', choices=BACKENDS, help="Inference backend. auto picks the one with the lowest overhead that works")
+parser.add_argument("-as", "--action_sinks", nargs='+', default=['keyboard'], help="Where fired actions go with --execute: " + SINKS)
+parser.add_argument("-ai", "--action_interval", type=float, default=0., help="Minimum seconds between two runs of the same action, unless set in the [RATE] section of the mapping")
+parser.add_argument("-c", "--cache", type=str2bool, default=False, help="Keep traced and converted copies of the .h5 checkpoint next to it, so later starts skip building the model")
+parser.add_argument("-w", "--warmup", type=float, default=2.0, help="Seconds the webcam is given to warm up, spent loading the model")
+parser.add_argument("-s", "--streaming", type=str2bool, default=True, help="Encode only the newest frame and reuse the cached embeddings of the window")
+parser.add_argument("-st", "--stateful", type=str2bool, default=False, help="In streaming mode, advance the GRU one frame at a time carrying its hidden state")
+parser.add_argument("-rs", "--resync", type=int, default=None, help="In stateful mode, rebuild the hidden state from the full window every N frames (0- never, default --qsize)")
+parser.add_argument("-q", "--qsize", type=int, default=qsize, help="Frames in the window the model classifies")
+parser.add_argument("-sq", "--sqsize", type=int, default=sqsize, help="Predictions the decisions are smoothed over")
+parser.add_argument("-th", "--threads", type=int, default=0, help="Threads per model operator (0- TensorFlow default)")
+parser.add_argument("-p", "--pipeline", type=str2bool, default=True, help="Run capture, inference and output on separate threads")
+parser.add_argument("-ql", "--queue_size", type=int, default=2, help="Maximum number of items waiting between two pipeline stages")
+parser.add_argument("-o", "--overload", default=None, choices=POLICIES, help="What a full queue of captured frames does with a new one, results are never dropped. Defaults to drop-oldest for the webcam and block for video files")
+parser.add_argument("-mg", "--motion_gate", type=str2bool, default=True, help="Thin out inference while the scene is still")
+parser.add_argument("-mt", "--motion_threshold", type=float, default=2.0, help="Mean absolute frame difference (0-255) that counts as motion")
+parser.add_argument("-ie", "--idle_every", type=int, default=10, help="While idle, classify only every N-th frame (0- none)")
+parser.add_argument("-rl", "--release", type=float, default=0.6, help="Smoothed score under which an active gesture is released")
+parser.add_argument("-cd", "--cooldown", type=float, default=0.5, help="Minimum time in seconds between two fired gestures")
+parser.add_argument("-off", "--offline", default='', help="Evaluate --video headless and save per-frame results to this .csv or .jsonl file")
+parser.add_argument("-bs", "--batch_size", type=int, default=64, help="Frames and windows per model call in offline mode")
+parser.add_argument("-mf", "--metrics", default='', help="Periodically save per-stage latency percentiles to this JSON file")
+parser.add_argument("-mi", "--metrics_interval", type=float, default=5.0, help="Seconds between two saves of --metrics")
+parser.add_argument("-mp", "--metrics_port", type=int, default=0, help="Serve Prometheus metrics on http://127.0.0.1:PORT/metrics (0- off)")
+parser.add_argument("-tr", "--trace", default='', help="Save a Chrome trace of every stage call to this JSON file")
 args = parser.parse_args()
 
-parser.print_help()
 verbose = args.verbose
+qsize, sqsize = args.qsize, args.sqsize
+if args.resync is None:
+    args.resync = qsize
 
 # read in configuration file for mapping of gestures to keyboard keys
-mapping = configparser.ConfigParser()
-action = {}
-if os.path.isfile(args.mapping):
-    mapping.read(args.mapping)
-    for m in mapping['MAPPING']: 
-        val = mapping['MAPPING'][m].split(',')
-        action[m] = {'fn': val[0], 'keys': val[1:]}  # fn: hotkey, press, typewrite
-
-else:
-    # print('[ERROR] Mapping file for gestures to keyboard keys is not found at ' + args.mapping)
-    raise FileNotFoundError(
-        errno.ENOENT, os.strerror(errno.ENOENT), args.mapping)
+action = load_mapping(args.mapping)
 
-if os.path.isfile(args.checkpoint):
-    model = tf.keras.models.load_model(args.checkpoint)
-    
-else:
+if not os.path.isfile(args.checkpoint):
     # print("[ERROR] No checkpoint found at '{}'".format(args.checkpoint))
     raise FileNotFoundError(
         errno.ENOENT, os.strerror(errno.ENOENT), args.checkpoint)
 
+# the keyboard sink needs pyautogui and a display, built once the checkpoint is
+# there and never for the headless --offline runs, which dispatch no action
+sinks = [make_sink(spec) for spec in args.action_sinks] if args.execute and not args.offline else []
+
+# each startup step is recorded as a stage, up to the first prediction
+metrics = Metrics(trace=bool(args.trace))
+t = metrics.record('startup_arguments', started)
+
+from imutils.video import VideoStream, FileVideoStream, FPS
+from display import Display
+from motion import MotionGate
+
+# initialize the video stream first, the camera sensor warms up while the
+# model loads
+if not args.offline:
+    if verbose>0: print("[INFO] Attemping to start video stream...")
+    if (args.video == ''):
+        vs = VideoStream(0, usePiCamera=False).start()
+    else:
+        vs = FileVideoStream(args.video).start()
+    camera = time.perf_counter()
+t = metrics.record('startup_camera', t)
+
+import tensorflow as tf
+from backends import TFLiteBackend, compile_model, set_threads
+from offline import clip_probabilities, video_probabilities, window_probabilities, write_results
+from streaming import FrameRing, StreamingModel, splittable
+set_threads(args.threads)
+t = metrics.record('startup_imports', t)
+
+cached = False
+if args.checkpoint.endswith('.tflite'):
+    # exported by Tensorflow/export.py, a fixed window that can only run whole
+    predict = TFLiteBackend(path=args.checkpoint)
+    qsize = predict.input_shape[0]
+    if verbose>0 and args.streaming: print("[INFO] Streaming is not available for TFLite checkpoints")
+    args.streaming = False
 
-# initialize the video stream, allow the cammera sensor to warmup,
-# and initialize the FPS counter
-if verbose>0: print("[INFO] Attemping to start video stream...")
+elif args.cache and not args.offline and not args.stateful and args.backend != 'keras':
+    # the step-wise head and the keras backend need the Keras model itself
+    from cache import ModelCache
+    cache = ModelCache(args.checkpoint, qsize)
+    if not cache.valid:
+        if verbose>0: print("[INFO] Building the model cache in {}...".format(cache.path))
+        cache.build(tf.keras.models.load_model(args.checkpoint), verbose)
+    if 'encoder' not in cache.inputs:
+        # a clip model (TSM, R2Plus1D) mixes the frames and runs on its own window only
+        if verbose>0 and args.streaming: print("[INFO] Streaming is not available for models that mix frames")
+        args.streaming = False
+        qsize = cache.inputs['model'][0]
+    if args.streaming:
+        encoder, head = cache.load('encoder', args.backend), cache.load('head', args.backend)
+        cached = encoder is not None and head is not None
+        if cached:
+            streaming = StreamingModel.from_backends(encoder, head, qsize)
+    else:
+        predict = cache.load('model', args.backend)
+        cached = predict is not None
+    # e.g. --backend tflite when the conversion failed at build time
+    if not cached and verbose>0: print("[INFO] The cache has no {} backend, loading the checkpoint instead".format(args.backend))
 
-if (args.video == ''):
-    vs = VideoStream(0, usePiCamera=False).start()
+if not args.checkpoint.endswith('.tflite') and not cached:
+    model = tf.keras.models.load_model(args.checkpoint)
+    if not splittable(model):
+        if verbose>0 and (args.streaming or args.stateful): print("[INFO] Streaming is not available for models that mix frames")
+        args.streaming = False
+        qsize = model.input_shape[1]
+        # offline, whole batches of windows go through the model at once
+        predict = compile_model(model, (qsize, 100, 100, 3), args.backend, batch_size=None if args.offline else 1)
+    elif args.offline:
+        pass
+    elif args.streaming:
+        streaming = StreamingModel(model, qsize, stateful=args.stateful, resync_every=args.resync, backend=args.backend)
+    else:
+        predict = compile_model(model, (qsize, 100, 100, 3), args.backend)
+t = metrics.record('startup_model', t)
+
+
+# same top1 for consecutive frames fires the gesture
+engine = DecisionEngine(num_classes, sqsize, threshold, release=args.release, confirm=2, cooldown=args.cooldown,
+                        background=(gesture_dict['Doing other things'], gesture_dict['No gesture']))
+
+if args.offline:
+    # headless run over a recorded video, as fast as the model allows
+    if verbose>0: print("[INFO] Evaluating {} offline...".format(args.video))
+    start = time.perf_counter()
+    if args.checkpoint.endswith('.tflite'):
+        probs, times = window_probabilities(predict, args.video, qsize)
+    elif not splittable(model):
+        probs, times = clip_probabilities(predict, args.video, qsize, args.batch_size)
+    else:
+        probs, times = video_probabilities(model, args.video, qsize, args.batch_size)
+    elapsed = time.perf_counter() - start
+
+    fired = engine.replay(probs, times)
+    write_results(args.offline, probs, times, fired, [gesture_dict[i] for i in range(num_classes)])
+    print("[INFO] {} frames in {:.2f}s ({:.2f} frames/s), {} gestures fired".format(len(probs), elapsed, len(probs) / elapsed, len(fired)))
+    print("[INFO] results saved to {}".format(args.offline))
+    sys.exit()
+
+# a first inference on a blank window, so the first frame does not pay for
+# allocations and lazy initializations
+frames = FrameRing(qsize, (100, 100))
+t = time.perf_counter()
+if args.streaming:
+    streaming.fill(frames.latest())
+    streaming(frames.latest())
 else:
-    vs = FileVideoStream(args.video).start()
+    predict(np.expand_dims(frames.view(), axis=0))
+t = metrics.record('startup_warmup', t)
+
+# whatever is left of the camera warmup
+if args.video == '':
+    time.sleep(max(args.warmup - (time.perf_counter() - camera), 0))
+metrics.record('startup_wait', t)
+if verbose>0: print("[INFO] startup: " + ", ".join("{} {:.2f}s".format(name[8:], stats.total)
+                                                  for name, stats in metrics.stages.items()) + ", total {:.2f}s".format(time.perf_counter() - started))
 
-time.sleep(2.0)
 fps = FPS().start()
-Q = deque(maxlen=qsize)
-SQ = deque(maxlen=sqsize)
-act = deque(['No gesture', "No gesture"], maxlen=3)
+last = {'top1': gesture_dict[0], 'score': 0.}
+gate = MotionGate(args.motion_threshold, args.idle_every, hold=qsize) if args.motion_gate else None
+# key injection runs on its own thread, the frame loop only queues actions
+dispatcher = Dispatcher(sinks, min_interval=args.action_interval, metrics=metrics) if sinks else None
+display = Display(args.display_fps, metrics=metrics) if args.debug else None
 
 # get first frame and use it to initialize our deque
 frame = vs.read()
@@ -97,90 +211,120 @@ if frame is None:
     print('[ERROR] No video stream is available')
 
 else:
-    for i in range(qsize):
-        Q.append(frame)
+    frames.fill(frame)
+    if args.streaming:
+        streaming.fill(frames.latest())
     if (verbose > 0): print('[INFO] Video stream started...')
 
+def capture():
+    # grab the frame from the threaded video stream, the webcam thread keeps
+    # handing back the same array until a new frame arrives
+    global frame
+    start = time.perf_counter()
+    last, frame = frame, vs.read()
+    if frame is last and frame is not None:
+        # idle until the next frame, kept out of the capture stage
+        while frame is last and frame is not None:
+            time.sleep(.001)
+            frame = vs.read()
+        start = metrics.record('frame_wait', start)
 
-# loop over the frames from the video stream
-while(True):
-    # grab the frame from the threaded video stream 
-    frame = vs.read()
     if frame is None: 
         print('[ERROR] No video stream is available')
-        break
-
-    oframe = cv2.flip(frame.copy(), 1)  # copy original frame for display later as mirror image
-    
-    Q.append(frame)
-
-    imgs = []
-    for img in Q:
-        img = tf.image.resize(img, (100, 100))/255
-        imgs.append(img)
-    
-    pred = model.predict(np.expand_dims(imgs, axis=0))
-    k = 5
-    kth = pred[0].argpartition(-k)[::-1][:k]
-    val = pred[0][kth]
-    top5 = [gesture_dict[kth[i]] for i in range(k)]
-
-    pi = [kth[i] for i in range(k)]
-    ps = [val[i] for i in range(k)]
-    top1 = top5[0] if ps[0] > threshold else gesture_dict[0]
-
-    hist = {}
-    for i in range(num_classes):
-        hist[i] = 0
-    for i in range(len(pi)):
-        hist[pi[i]] = ps[i]
-    SQ.append(list(hist.values()))
-
-    ave_pred = np.array(SQ).mean(axis=0)
-    top1 = gesture_dict[np.argmax(ave_pred)] if max(ave_pred) > threshold else gesture_dict[0]
-
-    # show the output frame
-    if (args.debug):
-        cv2.putText(oframe, top1 + ' %.2f' % ps[0], (20,20), cv2.FONT_HERSHEY_DUPLEX, 0.8, (255, 255, 255), 2, lineType=cv2.LINE_AA)
-        cv2.putText(oframe, top1 + ' %.2f' % ps[0], (20,20), cv2.FONT_HERSHEY_DUPLEX, 0.8, (0, 0, 0), 1, lineType=cv2.LINE_AA)
-        cv2.imshow("Frame", oframe)
-
-    top1 = top1.lower()
-    act.append(top1)
+        return STOP
+    t = metrics.record('capture', start)
+
+    if gate is None:
+        return {'frame': frame, 'time': t, 'infer': True}
+    item = {'frame': frame, 'time': t, 'infer': gate(frame), 'idle': gate.idle, 'energy': gate.energy}
+    metrics.record('gate', t)
+    return item
+
+def infer(item):
+    # idle scene, keep the last prediction
+    item['fired'] = None
+    if not item['infer']:
+        item.update(last)
+        return item
+
+    t = time.perf_counter()
+    frames.append(item['frame'])
+    t = metrics.record('preprocess', t)
+
+    if args.streaming:
+        pred = streaming(frames.latest())
+    else:
+        pred = predict(np.expand_dims(frames.view(), axis=0))
+    t = metrics.record('predict', t)
+    if verbose > 0 and metrics.stages['predict'].count == 1:
+        print("[INFO] first prediction {:.2f}s after start".format(t - started))
+
+    item['fired'] = engine.update(pred[0])
+    last['top1'] = gesture_dict[engine.label]
+    last['score'] = pred[0].max()
+    item.update(last)
+    metrics.record('decide', t)
+    return item
+
+def output(item):
+    # rendered here on the main thread, at most --display_fps times per second
+    if display is not None:
+        display.show(item)
+        if display.quit:
+            return STOP
 
     # control an application based on mapped outputs
-    # same top1 for consecutive frames
-    if (act[0] != act[1] and len(set(list(act)[1:])) == 1):
+    if item['fired'] is not None:
+        top1 = gesture_dict[item['fired']].lower()
         if top1 in action.keys():            
-            t = action[top1]['fn']
-            k = action[top1]['keys']
-            
-            if verbose > 1: print('[DEBUG]', top1, '-- ', t, str(k))
-            if t == 'typewrite':
-                pyautogui.typewrite(k)
-            elif t == 'press':
-                pyautogui.press(k)
-            elif t == 'hotkey':
-                for key in k:
-                    pyautogui.keyDown(key)
-                for key in k[::-1]:
-                    pyautogui.keyUp(key)
-                # pyautogui.hotkey(",".join(k))
-    
-    key = cv2.waitKey(1) & 0xFF
-
-    # if the `q` key was pressed, break from the loop
-    if key == ord("q"):
-        break
+            if verbose > 1: print('[DEBUG]', top1, '-- ', action[top1]['fn'], str(action[top1]['keys']))
+            if dispatcher is not None:
+                start = time.perf_counter()
+                dispatcher.submit(top1, action[top1], item['time'])
+                metrics.record('dispatch', start)
+    metrics.record('latency', item['time'])
 
     # update the FPS counter
     fps.update()
 
+
+# capture and inference run on their own threads, decisions and actions on
+# this one
+# a video file has no frame rate to keep up with, so it should not drop frames
+policy = args.overload or ('drop-oldest' if args.video == '' else 'block')
+pipeline = Pipeline(capture, [infer], output, maxsize=args.queue_size, policy=policy)
+
+metrics.gauge('dropped_frames', lambda: pipeline.dropped)
+# CPU time of every thread of the process, for the utilisation over an interval
+metrics.gauge('cpu_seconds', time.process_time)
+if gate is not None:
+    metrics.gauge('motion_idle', lambda: gate.idle)
+    metrics.gauge('motion_skipped_frames', lambda: gate.skipped)
+if args.metrics: metrics.export_every(args.metrics, args.metrics_interval)
+if args.metrics_port: metrics.serve(args.metrics_port)
+
+if frame is not None:
+    try:
+        pipeline.run(threaded=args.pipeline)
+    except KeyboardInterrupt:
+        pass
+if display is not None:
+    display.close()
+if dispatcher is not None:
+    dispatcher.close()
+
 # stop the timer and display FPS information
 fps.stop()
 print("[INFO] elasped time: {:.2f}".format(fps.elapsed()))
 print("[INFO] approx. FPS: {:.2f}".format(fps.fps()))
+if verbose > 0 and pipeline.dropped: print("[INFO] dropped frames: {}".format(pipeline.dropped))
+if verbose > 0 and gate is not None: print("[INFO] motion gate skipped {} of {} frames".format(gate.skipped, gate.frames))
+if verbose > 0 and dispatcher is not None: print("[INFO] actions: {} sent, {} coalesced, {} rate limited".format(dispatcher.sent, dispatcher.coalesced, dispatcher.limited))
+if verbose > 0: metrics.print()
+if args.metrics: metrics.save(args.metrics)
+if args.trace:
+    metrics.save_trace(args.trace)
+    print("[INFO] trace saved to {}".format(args.trace))
 
 # do a bit of cleanup
-cv2.destroyAllWindows()
 vs.stop()
\ No newline at end of file